@@ -6,8 +6,8 @@ Requires streamlit and lxml to be installed.
 """
 
 import os
-import sqlite3
 import sys
+from contextlib import closing
 
 import pandas as pd
 import streamlit as st
@@ -54,7 +54,7 @@ class Application:
         """
 
         dbfile = os.path.join(self.path, "articles.sqlite")
-        with sqlite3.connect(dbfile) as db:
+        with closing(Models.connect(dbfile)) as db:
             cur = db.cursor()
 
             # Query for best matches
@@ -63,32 +63,33 @@ class Application:
             # Get results grouped by document
             documents = Query.documents(results, topn)
 
+            # Get article metadata for all documents
+            metadata = Query.articles(cur, documents)
+
             articles = []
 
             # Print each result, sorted by max score descending
             for uid in sorted(
                 documents, key=lambda k: sum([x[0] for x in documents[k]]), reverse=True
             ):
-                cur.execute(
-                    "SELECT Title, Published, Publication, Design, Size, Sample, Method, Entry, Id, Reference "
-                    + "FROM articles WHERE id = ?",
-                    [uid],
-                )
-                article = cur.fetchone()
+                article = metadata[uid]
 
                 matches = "<br/>".join([text for _, text in documents[uid]])
 
-                title = "<a target='_blank' href='%s'>%s</a>" % (article[9], article[0])
+                title = "<a target='_blank' href='%s'>%s</a>" % (
+                    article.reference,
+                    article.title,
+                )
 
                 article = {
                     "Title": title,
-                    "Published": Query.date(article[1]),
-                    "Publication": article[2],
-                    "Design": Query.design(article[3]),
-                    "Sample": Query.sample(article[4], article[5]),
-                    "Method": Query.text(article[6]),
-                    "Entry": article[7],
-                    "Id": article[8],
+                    "Published": Query.date(article.published),
+                    "Publication": article.publication,
+                    "Design": Query.design(article.design),
+                    "Sample": Query.sample(article.size, article.sample),
+                    "Method": Query.text(article.method),
+                    "Entry": article.entry,
+                    "Id": article.id,
                     "Content": matches,
                 }
 
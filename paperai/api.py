@@ -3,10 +3,10 @@ Enhanced API that also returns document metadata
 """
 
 import os
-import sqlite3
 
 import txtai.api
 
+from paperai.pool import Pool
 from paperai.query import Query
 
 
@@ -15,6 +15,22 @@ class API(txtai.api.API):
     Extended API on top of txtai to return enriched query results.
     """
 
+    def __init__(self, config):
+        """
+        Create a new API.
+
+        Args:
+            config: API configuration
+        """
+        super().__init__(config)
+
+        # Read-only database connections shared by request threads
+        self.pool = (
+            Pool(os.path.join(self.config["path"], "articles.sqlite"))
+            if self.embeddings
+            else None
+        )
+
     def search(self, query, request):
         """
         Extend txtai API to enrich results with content.
@@ -27,7 +43,6 @@ class API(txtai.api.API):
             query results
         """
         if self.embeddings:
-            dbfile = os.path.join(self.config["path"], "articles.sqlite")
             limit = self.limit(request.query_params.get("limit"))
             threshold = (
                 float(request.query_params["threshold"])
@@ -35,14 +50,18 @@ class API(txtai.api.API):
                 else None
             )
 
-            with sqlite3.connect(dbfile) as db:
+            with self.pool.connection() as db:
                 cur = db.cursor()
 
-                # Query for best matches
-                results = Query.search(self.embeddings, cur, query, limit, threshold)
-
-                # Get results grouped by document
-                documents = Query.documents(results, limit)
+                # Query for best matches, grouped by document
+                _, documents, metadata = Query.results(
+                    self.embeddings,
+                    cur,
+                    query,
+                    limit,
+                    threshold,
+                    self.config["path"],
+                )
 
                 articles = []
 
@@ -52,28 +71,22 @@ class API(txtai.api.API):
                     key=lambda k: sum([x[0] for x in documents[k]]),
                     reverse=True,
                 ):
-                    cur.execute(
-                        "SELECT Title, Published, Publication, Design, "
-                        "Size, Sample, Method, Entry, Id, Reference "
-                        + "FROM articles WHERE id = ?",
-                        [uid],
-                    )
-                    article = cur.fetchone()
+                    article = metadata[uid]
 
                     score = max([score for score, text in documents[uid]])
                     matches = [text for _, text in documents[uid]]
 
                     article = {
-                        "id": article[8],
+                        "id": article.id,
                         "score": score,
-                        "title": article[0],
-                        "published": Query.date(article[1]),
-                        "publication": article[2],
-                        "design": Query.design(article[3]),
-                        "sample": Query.sample(article[4], article[5]),
-                        "method": Query.text(article[6]),
-                        "entry": article[7],
-                        "reference": article[9],
+                        "title": article.title,
+                        "published": Query.date(article.published),
+                        "publication": article.publication,
+                        "design": Query.design(article.design),
+                        "sample": Query.sample(article.size, article.sample),
+                        "method": Query.text(article.method),
+                        "entry": article.entry,
+                        "reference": article.reference,
                         "matches": matches,
                     }
 
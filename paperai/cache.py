@@ -0,0 +1,163 @@
+"""
+Cache module
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from .index import Index
+from .models import CONFIG_NAME, SHARDS_NAME
+
+
+class QueryCache:
+    """
+    In-process cache of query results.
+
+    Entries are keyed on model path, index version, normalized query text, number of
+    results and threshold. The least recently used entry is evicted once the cache
+    is full and entries expire after a time to live. The index version is derived
+    from the modification times of the index files when the index is loaded.
+    Callers pass the version of the index that computes the results, so results
+    from an index loaded before a rebuild are never returned for the rebuilt index.
+    """
+
+    def __init__(self, maxsize=256, ttl=300):
+        """
+        Create a new query cache.
+
+        Args:
+            maxsize: maximum number of cached queries
+            ttl: number of seconds before a cached query expires
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        # key -> (expiration time, value)
+        self.entries = OrderedDict()
+
+        # model path -> current index version
+        self.versions = {}
+
+        self.hits, self.misses = 0, 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def version(path):
+        """
+        Get the version of the index stored at path.
+
+        Args:
+            path: model path
+
+        Returns:
+            latest modification time of the index files, None if no index is found
+        """
+        mtimes = [
+            os.stat(os.path.join(path, name)).st_mtime_ns
+            for name in [CONFIG_NAME, Index.STATE, SHARDS_NAME]
+            if os.path.exists(os.path.join(path, name))
+        ]
+
+        return max(mtimes) if mtimes else None
+
+    @staticmethod
+    def normalize(query):
+        """
+        Normalize query text. Query tokens are matched case-insensitively, so the
+        query is lowercased and whitespace is collapsed.
+
+        Args:
+            query: query text
+
+        Returns:
+            normalized query text
+        """
+        return " ".join(query.lower().split())
+
+    def get(self, path, version, query, topn, threshold, compute):
+        """
+        Get cached results for a query, computing and caching them on a miss.
+
+        Args:
+            path: model path
+            version: version of the index used to compute results, see
+                     QueryCache.version
+            query: query text
+            topn: number of results
+            threshold: query match score threshold
+            compute: function called with no arguments to compute results
+
+        Returns:
+            query results
+        """
+        path = os.path.abspath(str(path))
+        key = (path, version, QueryCache.normalize(query), topn, threshold)
+
+        with self.lock:
+            # Purge entries for previous versions once a newer index is used. Callers
+            # still holding an older index don't purge entries for the newer index.
+            latest = self.versions.get(path)
+            if latest is None or (version is not None and version > latest):
+                self.purge(path, version)
+                self.versions[path] = version
+
+            entry = self.entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+            self.misses += 1
+
+        # Compute outside of the lock, concurrent misses for the same key compute
+        # the same results
+        value = compute()
+
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+
+            # Evict least recently used entries
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+        return value
+
+    def purge(self, path, version):
+        """
+        Remove entries for other versions of a model path. Caller must hold the
+        lock.
+
+        Args:
+            path: model path
+            version: index version to keep
+        """
+        for key in [
+            key for key in self.entries if key[0] == path and key[1] != version
+        ]:
+            del self.entries[key]
+
+    def clear(self):
+        """
+        Remove all entries and reset statistics.
+        """
+        with self.lock:
+            self.entries.clear()
+            self.versions.clear()
+            self.hits, self.misses = 0, 0
+
+    def stats(self):
+        """
+        Get cache statistics.
+
+        Returns:
+            dict with number of hits, misses and cached entries
+        """
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self.entries)}
+
+
+# Shared query cache for all entry points
+CACHE = QueryCache()
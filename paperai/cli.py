@@ -6,7 +6,7 @@ import warnings
 from json import dumps
 from pathlib import Path
 from sqlite3 import Connection, Cursor
-from typing import List, Optional, Tuple
+from typing import List, Optional, Tuple, Union
 
 import typer
 from beartype import beartype
@@ -20,9 +20,14 @@ from paperai import utils
 
 from .models import Models
 from .query import Query
+from .registry import REGISTRY
+from .shards import Shards
 
 app = typer.Typer()
 
+# Loaded embeddings index, single or sharded
+EmbeddingsIndex = Union[Embeddings, Shards]
+
 
 @app.callback()
 def app_callback(
@@ -44,23 +49,29 @@ def app_callback(
 
 
 @beartype
-def load_model(model_path: Path) -> Tuple[Embeddings, Connection]:
+def load_model(
+    model_path: Path, mmap: bool = False
+) -> Tuple[EmbeddingsIndex, Connection]:
     """
     Load model from model_path.
+
+    With mmap, the ANN index is memory mapped read-only and shared between
+    processes through the page cache.
     """
-    embeddings, db = Models.load_path(model_path)
+    embeddings, db = REGISTRY.load(model_path, mmap)
     if embeddings is None:
         logging.error(
             "No embeddings found for model.",
             extra=dict(model_path=model_path, db_connection=db),
         )
+        REGISTRY.close(embeddings, db)
         raise ValueError("No embeddings found for model.")
     return embeddings, db
 
 
 @beartype
 def query_for_results(
-    embeddings: Embeddings,
+    embeddings: EmbeddingsIndex,
     cur: Cursor,
     query_text: str,
     n: int,
@@ -102,41 +113,68 @@ def rich_print(all_results: List[utils.QueryResults]):
 @beartype
 def model_query(
     query_text: str,
-    embeddings: Embeddings,
+    embeddings: EmbeddingsIndex,
     db: Connection,
     n: int = 10,
     threshold: Optional[float] = None,
+    model_path: Optional[Path] = None,
 ) -> List[utils.QueryResults]:
     """
     Query model for results.
+
+    Results are cached per model_path, no caching is done if model_path is None.
     """
     # Query.query(embeddings, db, line, None, None)
 
     cur = db.cursor()
 
-    # Query for best matches
-    results = query_for_results(embeddings, cur, query_text, n, threshold=threshold)
+    # Query for best matches, grouped by document
+    _, documents, articles = Query.results(
+        embeddings, cur, query_text, n, threshold, model_path
+    )
+
+    return build_results(documents, articles)
+
+
+@beartype
+def model_batch_query(
+    query_texts: List[str],
+    embeddings: EmbeddingsIndex,
+    db: Connection,
+    n: int = 10,
+    threshold: Optional[float] = None,
+) -> List[List[utils.QueryResults]]:
+    """
+    Query model for results of many queries.
+
+    Queries are searched together and share database lookups.
+    """
+    cur = db.cursor()
+
+    return [
+        build_results(documents, articles)
+        for _, documents, articles in Query.batchresults(
+            embeddings, cur, query_texts, n, threshold
+        )
+    ]
 
-    # Get results grouped by document
-    documents = Query.documents(results, n)
 
+def build_results(documents: dict, articles: dict) -> List[utils.QueryResults]:
+    """
+    Build query results from results grouped by document.
+    """
     all_results = []
     for uid in sorted(
         documents, key=lambda k: sum([x[0] for x in documents[k]]), reverse=True
     ):
-        cur.execute(
-            "SELECT Title, Published, Publication, Design, Size, "
-            "Sample, Method, Entry, Id, Reference FROM articles WHERE id = ?",
-            [uid],
-        )
-        article = cur.fetchone()
+        article = articles[uid]
         query_result_dict = {
-            "title": article[0],
-            "published": Query.date(article[1]),
-            "publication": article[2],
-            "entry": article[7],
-            "id": article[8],
-            "reference": article[9],
+            "title": article.title,
+            "published": Query.date(article.published),
+            "publication": article.publication,
+            "entry": article.entry,
+            "id": article.id,
+            "reference": article.reference,
         }
         for document_match in documents[uid]:
             score, text = document_match
@@ -170,6 +208,7 @@ def query_model(
         threshold=score_threshold,
         embeddings=embeddings,
         db=db,
+        model_path=model_path,
     )
 
     if output_type == utils.OutputType.JSON:
@@ -178,6 +217,50 @@ def query_model(
     elif output_type == utils.OutputType.RICH:
         rich_print(query_results)
 
+    REGISTRY.close(embeddings, db)
+
+
+@app.command()
+def query_batch(
+    queries: typer.FileText = typer.Argument("-"),
+    model_path: Path = typer.Option(Models.modelPath(), dir_okay=True, exists=True),
+    n: int = typer.Option(10),
+    score_threshold: Optional[float] = typer.Option(None),
+    batch_size: int = typer.Option(64),
+):
+    """
+    Query model with many queries, one query per line.
+
+    Results are printed as NDJSON, one line per query.
+    """
+    if batch_size < 1:
+        raise typer.BadParameter(
+            "Batch size must be at least 1.", param_hint="'--batch-size'"
+        )
+    query_texts = [line.strip() for line in queries if line.strip()]
+    if len(query_texts) == 0:
+        logging.warning("No queries.", extra=dict(model_path=model_path))
+        return
+    embeddings, db = load_model(model_path=model_path)
+
+    try:
+        for x in range(0, len(query_texts), batch_size):
+            batch = query_texts[x : x + batch_size]
+            for query_text, query_results in zip(
+                batch,
+                model_batch_query(
+                    query_texts=batch,
+                    n=n,
+                    threshold=score_threshold,
+                    embeddings=embeddings,
+                    db=db,
+                ),
+            ):
+                dictified = [result.__dict__ for result in query_results]
+                print(dumps(dict(query=query_text, results=dictified)), flush=True)
+    finally:
+        REGISTRY.close(embeddings, db)
+
 
 @app.command()
 def preview_doi(
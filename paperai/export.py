@@ -34,9 +34,14 @@ class Export:
             db = sqlite3.connect(dbfile)
             cur = db.cursor()
 
+            # Use precomputed section filter, if available
+            query = (
+                Index.INDEXABLE_QUERY if Index.indexable(cur) else Index.SECTION_QUERY
+            )
+
             # Get all indexed text, with a detected study design, excluding
             # modeling designs
-            cur.execute(Index.SECTION_QUERY + " AND design NOT IN (0, 9)")
+            cur.execute(query + " AND design NOT IN (0, 9)")
 
             count = 0
             for _, name, text in cur:
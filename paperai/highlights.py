@@ -3,11 +3,196 @@ Highlights module
 """
 
 import itertools
+import zlib
+from collections import defaultdict
 
 import networkx
+import numpy as np
+from scipy import sparse
 from txtai.pipeline import Tokenizer
 
 
+class MinHash:
+    """
+    MinHash signatures of token sets with LSH banding.
+
+    Signatures are split into bands, token sets sharing all the rows of any band
+    are candidates for being similar. More bands with fewer rows per band find more
+    similar pairs (more accurate) at the cost of more candidates (slower). Pairs
+    with a Jaccard index of about (1 / bands) ^ (1 / rows) are found half the time.
+    """
+
+    # Mersenne prime used for universal hashing
+    PRIME = (1 << 31) - 1
+
+    def __init__(self, permutations=64, bands=32, floor=0.1, seed=0):
+        """
+        Create a new MinHash LSH instance.
+
+        Args:
+            permutations: number of hash functions in a signature
+            bands: number of LSH bands, must divide permutations
+            floor: minimum Jaccard index for graph edges between candidate pairs
+            seed: random seed for hash functions
+        """
+        if permutations % bands:
+            raise ValueError("permutations must be a multiple of bands")
+
+        self.bands, self.rows, self.floor = bands, permutations // bands, floor
+
+        # Hash functions (a * x + b) % PRIME
+        generator = np.random.default_rng(seed)
+        self.a = generator.integers(1, MinHash.PRIME, permutations, dtype=np.uint64)
+        self.b = generator.integers(0, MinHash.PRIME, permutations, dtype=np.uint64)
+
+    def signatures(self, sets, batch=256):
+        """
+        Build MinHash signatures for a list of token sets.
+
+        Args:
+            sets: list of token sets
+            batch: number of token sets hashed at once
+
+        Returns:
+            signatures matrix with one row per token set
+        """
+        signatures = np.full((len(sets), self.a.shape[0]), MinHash.PRIME, np.uint64)
+
+        for start in range(0, len(sets), batch):
+            # Stable token hashes, reduced to fit universal hashing in 64 bits
+            hashes, offsets, rows = [], [], []
+            for x, tokens in enumerate(sets[start : start + batch]):
+                if tokens:
+                    offsets.append(len(hashes))
+                    rows.append(start + x)
+                    hashes.extend(zlib.crc32(token.encode()) for token in tokens)
+
+            if hashes:
+                hashes = np.array(hashes, dtype=np.uint64) % MinHash.PRIME
+                values = (np.outer(hashes, self.a) + self.b) % MinHash.PRIME
+
+                # Minimum hash value per token set and hash function
+                signatures[rows] = np.minimum.reduceat(values, offsets, axis=0)
+
+        return signatures
+
+    def keys(self, signatures):
+        """
+        Build LSH bucket keys, one per signature and band.
+
+        Args:
+            signatures: signatures matrix
+
+        Returns:
+            keys matrix with one row per signature and one column per band
+        """
+        # Combine the rows of each band into a single 64-bit hash, overflow wraps
+        bands = signatures.reshape(signatures.shape[0], self.bands, self.rows)
+        with np.errstate(over="ignore"):
+            return (bands * self.a[: self.rows]).sum(axis=2, dtype=np.uint64)
+
+    def pairs(self, signatures):
+        """
+        Find candidate pairs of similar token sets.
+
+        Args:
+            signatures: signatures matrix
+
+        Returns:
+            array of (index1, index2) candidate pairs with index1 < index2
+        """
+        size = signatures.shape[0]
+        pairs = []
+
+        for keys in self.keys(signatures).T:
+            # Sort signatures by band key, equal keys form a bucket
+            order = np.argsort(keys, kind="stable")
+            keys = keys[order]
+
+            # End position of the bucket for each sorted position
+            starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+            ends = np.repeat(np.r_[starts[1:], size], np.diff(np.r_[starts, size]))
+
+            # Pair each position with all following positions in the same bucket
+            counts = ends - np.arange(size) - 1
+            left = np.repeat(np.arange(size), counts)
+            right = (
+                left
+                + 1
+                + np.arange(counts.sum())
+                - np.repeat(np.cumsum(counts) - counts, counts)
+            )
+
+            x, y = order[left], order[right]
+            pairs.append(np.minimum(x, y) * size + np.maximum(x, y))
+
+        if not pairs:
+            return np.empty((0, 2), dtype=np.int64)
+
+        # Deduplicate pairs found in multiple bands
+        pairs = np.unique(np.concatenate(pairs))
+        return np.stack([pairs // size, pairs % size], axis=1)
+
+
+class MMR:
+    """
+    Maximal marginal relevance (MMR) highlights over embeddings vectors.
+
+    Sections are selected one at a time, maximizing relevance to the query while
+    penalizing similarity to already selected sections. Relevance is the search
+    score of the section and similarity is the dot product of section vectors.
+    """
+
+    def __init__(self, embeddings, diversity=0.5):
+        """
+        Create a new MMR instance.
+
+        Args:
+            embeddings: embeddings index used to transform sections into vectors
+            diversity: trade-off between relevance (0.0) and diversity (1.0)
+        """
+        self.embeddings = embeddings
+        self.diversity = diversity
+
+    def __call__(self, sections, topn):
+        """
+        Select highlights from a list of scored sections.
+
+        Args:
+            sections: list of (uid, score, text)
+            topn: top n results to return
+
+        Returns:
+            top n sections, in selection order
+        """
+        if not sections:
+            return []
+
+        # Transform sections into normalized vectors with a single batch call
+        vectors = np.array(
+            self.embeddings.batchtransform(
+                [(uid, Tokenizer.tokenize(text), None) for uid, _, text in sections]
+            )
+        )
+
+        relevance = np.array([score for _, score, _ in sections])
+
+        # Maximum similarity of each section to the selected sections
+        similarity = np.zeros(len(sections))
+        selected = []
+
+        for _ in range(min(topn, len(sections))):
+            scores = (1 - self.diversity) * relevance - self.diversity * similarity
+            scores[selected] = -np.inf
+
+            x = int(np.argmax(scores))
+            selected.append(x)
+
+            similarity = np.maximum(similarity, vectors @ vectors[x])
+
+        return [sections[x][2] for x in selected]
+
+
 class Highlights:
     """
     Methods to extract highlights from a list of text sections.
@@ -60,7 +245,7 @@ class Highlights:
     }
 
     @staticmethod
-    def build(sections, topn):
+    def build(sections, topn, minhash=None):
         """
         Extract highlights from a list of sections.
 
@@ -68,39 +253,98 @@ class Highlights:
         across the input list. This method attempts to return important but
         unique results to limit repetitive statements.
 
+        When minhash is set, graph edges are only computed for LSH candidate pairs
+        and sections are only compared to results sharing an LSH bucket. This is
+        faster for large lists of sections but approximate.
+
         Args:
             sections: input sections
             topn: top n results to return
+            minhash: optional MinHash instance
 
         Results:
             top n sections
         """
+        # Tokenize sections once, tokens are shared by textrank and the uniqueness
+        # check
+        vectors = Highlights.vectors(sections)
+
         results = []
 
+        # LSH buckets of results
+        buckets = defaultdict(list)
+
         # Rank the text using textrank for importance within collection
-        for uid, _ in Highlights.textrank(sections):
-            # Lookup text and tokenize
-            text = [text for u, text in sections if u == uid][0]
-            tokens = Highlights.tokenize(text)
+        for uid, _ in Highlights.textrank(sections, minhash, vectors):
+            # Lookup tokens
+            tokens = vectors[uid]
+
+            if minhash:
+                # Only compare to results that share a LSH bucket
+                keys = list(enumerate(minhash.keys(minhash.signatures([tokens]))[0]))
+                candidates = {x for key in keys for x in buckets.get(key, [])}
+                compare = [results[x][1] for x in sorted(candidates)]
+            else:
+                compare = [t for _, t in results]
 
             # Compare text to existing results, look for highly unique results
             # This finds results that are important but not repetitive
-            unique = all(Highlights.jaccardIndex(t, tokens) <= 0.2 for _, t in results)
+            unique = all(Highlights.jaccardIndex(t, tokens) <= 0.2 for t in compare)
             if unique:
+                if minhash:
+                    for key in keys:
+                        buckets[key].append(len(results))
+
                 results.append((uid, tokens))
 
-        uids = [uid for uid, _ in results][:topn]
+                # Stop once there are enough results
+                if len(results) >= topn:
+                    break
+
+        uids = {uid for uid, _ in results[:topn]}
 
         # Get related text for each match
         return [text for uid, text in sections if uid in uids]
 
     @staticmethod
-    def textrank(sections):
+    def textrank(sections, minhash=None, vectors=None):
         """
         Run the textrank algorithm against the list of sections.
 
         Orders the list into descending order of importance given the list.
 
+        Args:
+            sections: list of sentences
+            minhash: optional MinHash instance used to find graph edges
+            vectors: optional tokens by uid, tokenizes sections if None
+
+        Returns:
+            sorted list using the textrank algorithm
+        """
+        if vectors is None:
+            vectors = Highlights.vectors(sections)
+
+        # Build the graph adjacency matrix
+        uids, matrix = (
+            Highlights.buildMinHashMatrix(vectors, minhash)
+            if minhash
+            else Highlights.buildMatrix(vectors)
+        )
+
+        # Run pagerank
+        rank = Highlights.pagerank(matrix)
+
+        # Return items sorted by highest score first
+        return sorted(zip(uids, rank.tolist()), key=lambda x: x[1], reverse=True)
+
+    @staticmethod
+    def textrankGraph(sections):
+        """
+        Run the textrank algorithm against the list of sections using networkx.
+
+        Reference implementation of textrank, kept to validate the vectorized
+        implementation.
+
         Args:
             sections: list of sentences
 
@@ -116,6 +360,141 @@ class Highlights:
         # Return items sorted by highest score first
         return sorted(list(rank.items()), key=lambda x: x[1], reverse=True)
 
+    @staticmethod
+    def buildMatrix(vectors):
+        """
+        Build a weighted adjacency matrix of nodes using input.
+
+        Produces the same edge weights as buildGraph. Token sets are encoded as
+        rows of a sparse binary matrix and all pairwise intersection sizes are
+        computed with a single sparse matrix product.
+
+        Args:
+            vectors: tokens by node uid
+
+        Returns:
+            (list of node uids, sparse matrix of Jaccard index edge weights)
+        """
+        uids = list(vectors)
+
+        # Encode token sets for nodes with at least 3 tokens as a binary matrix
+        vocab, rows, cols = {}, [], []
+        for x, uid in enumerate(uids):
+            if len(vectors[uid]) >= 3:
+                for token in vectors[uid]:
+                    rows.append(x)
+                    cols.append(vocab.setdefault(token, len(vocab)))
+
+        tokens = sparse.csr_matrix(
+            (np.ones(len(rows)), (rows, cols)), shape=(len(uids), len(vocab))
+        )
+
+        # Pairwise intersection sizes
+        intersection = sparse.coo_matrix(tokens @ tokens.T)
+        intersection.setdiag(0)
+        intersection.eliminate_zeros()
+
+        # Jaccard index = |A & B| / (|A| + |B| - |A & B|)
+        sizes = np.asarray(tokens.sum(axis=1)).ravel()
+        i, j, n = intersection.row, intersection.col, intersection.data
+        weights = n / (sizes[i] + sizes[j] - n)
+
+        return uids, sparse.csr_matrix((weights, (i, j)), shape=(len(uids),) * 2)
+
+    @staticmethod
+    def buildMinHashMatrix(vectors, minhash):
+        """
+        Build a weighted adjacency matrix of nodes using MinHash LSH.
+
+        Only LSH candidate pairs are compared and only pairs with a Jaccard index
+        of at least the MinHash floor are connected.
+
+        Args:
+            vectors: tokens by node uid
+            minhash: MinHash instance
+
+        Returns:
+            (list of node uids, sparse matrix of Jaccard index edge weights)
+        """
+        uids = list(vectors)
+
+        # Encode token sets for nodes with at least 3 tokens as a binary matrix
+        indices = [x for x, uid in enumerate(uids) if len(vectors[uid]) >= 3]
+        vocab, rows, cols = {}, [], []
+        for x in indices:
+            for token in vectors[uids[x]]:
+                rows.append(x)
+                cols.append(vocab.setdefault(token, len(vocab)))
+
+        tokens = sparse.csr_matrix(
+            (np.ones(len(rows)), (rows, cols)), shape=(len(uids), len(vocab))
+        )
+
+        # Find candidate pairs
+        pairs = minhash.pairs(minhash.signatures([vectors[uids[x]] for x in indices]))
+        i, j = np.array(indices, dtype=np.int64)[pairs].T.reshape(2, -1)
+
+        # Jaccard index for candidate pairs
+        n = np.asarray(tokens[i].multiply(tokens[j]).sum(axis=1)).ravel()
+        sizes = np.asarray(tokens.sum(axis=1)).ravel()
+        weights = n / np.maximum(sizes[i] + sizes[j] - n, 1)
+
+        # Connect pairs at or above the similarity floor
+        mask = (weights > 0) & (weights >= minhash.floor)
+        i, j, weights = i[mask], j[mask], weights[mask]
+
+        return uids, sparse.csr_matrix(
+            (
+                np.concatenate([weights, weights]),
+                (np.concatenate([i, j]), np.concatenate([j, i])),
+            ),
+            shape=(len(uids),) * 2,
+        )
+
+    @staticmethod
+    def pagerank(matrix, alpha=0.85, maxiter=100, tol=1.0e-6):
+        """
+        Run pagerank power iteration over a weighted adjacency matrix.
+
+        Mirrors networkx.pagerank: rows are normalized to transition probabilities
+        and the rank of dangling nodes (nodes without weighted edges) is
+        redistributed uniformly. Iteration stops once the L1 change is below
+        N * tol. Unlike networkx, the last iterate is returned if iteration
+        doesn't converge within maxiter iterations.
+
+        Args:
+            matrix: sparse adjacency matrix with edge weights
+            alpha: damping factor
+            maxiter: maximum number of iterations
+            tol: error tolerance used to check convergence
+
+        Returns:
+            array of pagerank scores
+        """
+        size = matrix.shape[0]
+        if not size:
+            return np.array([])
+
+        # Normalize rows to transition probabilities
+        weights = np.asarray(matrix.sum(axis=1)).ravel()
+        dangling = weights == 0
+        weights[~dangling] = 1.0 / weights[~dangling]
+        matrix = sparse.diags(weights) @ matrix
+
+        # Uniform start vector and personalization
+        p = np.repeat(1.0 / size, size)
+        x = p
+
+        for _ in range(maxiter):
+            last = x
+            x = alpha * (x @ matrix + x[dangling].sum() * p) + (1 - alpha) * p
+
+            # Check convergence, l1 norm
+            if np.abs(x - last).sum() < size * tol:
+                break
+
+        return x
+
     @staticmethod
     def buildGraph(nodes):
         """
@@ -132,7 +511,7 @@ class Highlights:
 
         # Tokenize nodes, store uid and tokens
         vectors = []
-        for (uid, text) in nodes:
+        for uid, text in nodes:
             # Custom tokenization that works best with textrank matching
             tokens = Highlights.tokenize(text)
 
@@ -153,6 +532,25 @@ class Highlights:
 
         return graph
 
+    @staticmethod
+    def vectors(nodes):
+        """
+        Tokenize nodes.
+
+        Args:
+            nodes: list of (uid, text)
+
+        Returns:
+            {uid: tokens}, the first text is used for duplicate uids
+        """
+        vectors = {}
+        for uid, text in nodes:
+            if uid not in vectors:
+                # Custom tokenization that works best with textrank matching
+                vectors[uid] = Highlights.tokenize(text)
+
+        return vectors
+
     @staticmethod
     def jaccardIndex(set1, set2):
         """
@@ -2,16 +2,241 @@
 Indexing module
 """
 
+import copy
+import itertools
+import os
 import os.path
+import pickle
+import shutil
 import sqlite3
 import sys
+import tempfile
+import time
+import zlib
+from collections import deque
+from multiprocessing import Pool
 
+import numpy as np
 import regex as re
 import yaml
+from txtai.ann import ANNFactory
 from txtai.embeddings import Embeddings
+from txtai.embeddings.reducer import Reducer
 from txtai.pipeline import Tokenizer
 
-from .models import Models
+from .models import CONFIG_NAME, SHARDS_NAME, Models
+
+
+def tokenize(rows):
+    """
+    Multiprocessing helper method. Filters and tokenizes a chunk of section rows.
+
+    Args:
+        rows: list of (id, name, text)
+
+    Returns:
+        list of (id, tokens) for rows that pass the section filter
+    """
+    documents = []
+    for uid, name, text in rows:
+        if not name or not re.search(Index.SECTION_FILTER, name.lower()):
+            documents.append((uid, Tokenizer.tokenize(text)))
+
+    return documents
+
+
+class Tokens:
+    """
+    Tokenized documents spilled to a file on disk. Allows for multiple iterations.
+    """
+
+    def __init__(self, documents=None, path=None, count=0):
+        """
+        Create a new token spill. Consumes documents and writes each one to disk.
+
+        If documents is None, an existing spill file at path holding count
+        documents is reopened instead.
+
+        Args:
+            documents: list of (id, tokens, tags)
+            path: output file path, if None a temporary file is created
+            count: number of documents in an existing spill file
+        """
+        # Reopen existing spill file
+        if documents is None:
+            self.path, self.count = path, count
+            return
+
+        # Create a temporary working file if a path isn't provided
+        if not path:
+            with tempfile.NamedTemporaryFile(suffix=".tokens", delete=False) as output:
+                path = output.name
+
+        self.path, self.count = path, 0
+
+        try:
+            # Stream documents to working file
+            with open(self.path, "wb") as output:
+                for document in documents:
+                    pickle.dump(document, output, protocol=pickle.HIGHEST_PROTOCOL)
+                    self.count += 1
+        except BaseException:
+            # Remove partially written file
+            self.close()
+            raise
+
+    def __iter__(self):
+        """
+        Replay documents from the spill file.
+
+        Returns:
+            generator
+        """
+        with open(self.path, "rb") as spill:
+            for _ in range(self.count):
+                yield pickle.load(spill)
+
+    def __len__(self):
+        """
+        Number of documents in the spill file.
+
+        Returns:
+            count
+        """
+        return self.count
+
+    def close(self):
+        """
+        Remove the spill file.
+        """
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class Checkpoint:
+    """
+    Checkpoint directory for an index build. Stores the token spill, scoring state
+    and completed vector batches so an interrupted build can be resumed.
+    """
+
+    def __init__(self, path, config, maxsize, resume=False):
+        """
+        Create a new checkpoint.
+
+        Args:
+            path: checkpoint directory
+            config: index configuration
+            maxsize: maximum number of documents to process
+            resume: reuse existing checkpoint state, if it matches config and maxsize
+        """
+        self.path = path
+
+        # Initial state
+        self.state = {
+            "config": copy.deepcopy(config),
+            "maxsize": maxsize,
+            "tokens": None,
+            "scoring": False,
+            "batches": 0,
+            "documents": 0,
+            "uid": None,
+            "entry": None,
+        }
+
+        statefile = self.file("state.yml")
+        if resume and os.path.isfile(statefile):
+            with open(statefile, "r", encoding="utf-8") as f:
+                state = yaml.safe_load(f)
+
+            # Only resume builds with the same parameters
+            if state["config"] == config and state["maxsize"] == maxsize:
+                self.state = state
+                return
+
+            print("Checkpoint parameters changed, starting new build")
+
+        # Start from an empty directory
+        self.clear()
+        os.makedirs(self.path)
+
+    def file(self, name):
+        """
+        Get path to a file in the checkpoint directory.
+
+        Args:
+            name: file name
+
+        Returns:
+            path
+        """
+        return os.path.join(self.path, name)
+
+    def update(self, **kwargs):
+        """
+        Update and persist checkpoint state.
+
+        Args:
+            kwargs: state fields to update
+        """
+        self.state.update(kwargs)
+
+        # Write to a temporary file and swap, state is never partially written
+        with open(self.file("state.tmp"), "w", encoding="utf-8") as f:
+            yaml.safe_dump(self.state, f)
+
+        os.replace(self.file("state.tmp"), self.file("state.yml"))
+
+    def write(self, ids, vectors):
+        """
+        Persist a completed batch of document vectors.
+
+        Args:
+            ids: document ids
+            vectors: document vectors
+        """
+        batch = self.state["batches"]
+
+        with open(self.file("batch.tmp"), "wb") as output:
+            pickle.dump((ids, vectors), output, protocol=pickle.HIGHEST_PROTOCOL)
+
+        os.replace(self.file("batch.tmp"), self.file("vectors-%06d" % batch))
+
+        self.update(
+            batches=batch + 1,
+            documents=self.state["documents"] + len(ids),
+            uid=ids[-1],
+        )
+
+    def read(self):
+        """
+        Read all completed vector batches.
+
+        Returns:
+            (ids, vectors), vectors is an empty array if no batches were written
+        """
+        ids, vectors = [], np.empty((0, 0), dtype=np.float32)
+        for batch in range(self.state["batches"]):
+            with open(self.file("vectors-%06d" % batch), "rb") as queue:
+                uids, embeddings = pickle.load(queue)
+
+            # Allocate output array once, sized using the first batch
+            if not batch:
+                vectors = np.empty(
+                    (self.state["documents"], embeddings.shape[1]),
+                    dtype=embeddings.dtype,
+                )
+
+            vectors[len(ids) : len(ids) + len(uids)] = embeddings
+            ids.extend(uids)
+
+        return ids, vectors
+
+    def clear(self):
+        """
+        Remove the checkpoint directory.
+        """
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
 
 
 class Index:
@@ -26,24 +251,181 @@ class Index:
         "WHERE (labels is null or labels NOT IN ('FRAGMENT', 'QUESTION'))"
     )
 
+    # Section filter for databases with a precomputed indexable column, which
+    # combines the label and section filters. Sections added after the last
+    # Index.prepare run have a NULL indexable column and fall back to the label
+    # filter. Their name is selected with INDEXABLE_NAME for the section filter,
+    # evaluated sections select a NULL name which always passes the section filter.
+    INDEXABLE_FILTER = (
+        "(indexable = 1 OR (indexable IS NULL AND "
+        "(labels is null or labels NOT IN ('FRAGMENT', 'QUESTION'))))"
+    )
+    INDEXABLE_NAME = "CASE WHEN indexable IS NULL THEN Name END"
+    INDEXABLE_QUERY = "SELECT Id, %s, Text FROM sections WHERE %s" % (
+        INDEXABLE_NAME,
+        INDEXABLE_FILTER,
+    )
+
+    # FTS5 full text index over section text
+    FULLTEXT = "sections_fts"
+
+    # Number of rows read from the database and tokenized per chunk
+    CHUNK_SIZE = 1000
+
+    # Build state file, stored in the model path
+    STATE = "index.yml"
+
+    # Number of documents transformed to vectors between build checkpoints
+    CHECKPOINT_SIZE = 100000
+
+    # Index files saved to the model path by a single index build
+    FILES = ["config", "embeddings", "lsa", "scoring"]
+
+    @staticmethod
+    def prepare(dbfile, fulltext=False):
+        """
+        Prepare an articles.sqlite file for indexing.
+
+        Adds an indexable column to the sections table that stores the result of
+        the label and section name filters, along with a partial index over
+        indexable sections. Rows added after a previous run are filled in. Readers
+        then select indexable rows with a SQL predicate instead of running the
+        section filter regex per row. An index over the article column is also
+        created.
+
+        When fulltext is set, a FTS5 trigram index over section text is also
+        (re)built. Queries use it to look up sections containing required and
+        prohibited tokens. If a full text index already exists, rows added after a
+        previous run are added to it. Sections are expected to be append only, run
+        with fulltext set to rebuild the index after existing sections change.
+
+        Args:
+            dbfile: input SQLite file
+            fulltext: build a full text index over section text
+        """
+        db = sqlite3.connect(dbfile)
+        cur = db.cursor()
+
+        if not Index.indexable(cur):
+            cur.execute("ALTER TABLE sections ADD COLUMN indexable INTEGER")
+
+        # Add new rows to an existing full text index, rebuilt below when fulltext set
+        if not fulltext and Index.fulltext(cur):
+            cur.execute(
+                "INSERT INTO %s(rowid, Text) SELECT Id, Text FROM sections "
+                "WHERE indexable IS NULL" % Index.FULLTEXT
+            )
+            print("Added %d sections to full text index" % cur.rowcount)
+
+        # Evaluate filters for new rows
+        db.create_function("filtered", 2, Index.filtered, deterministic=True)
+        cur.execute(
+            "UPDATE sections SET indexable = filtered(name, labels) "
+            "WHERE indexable IS NULL"
+        )
+        print("Prepared %d sections" % cur.rowcount)
+
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS section_indexable "
+            "ON sections(article) WHERE indexable = 1"
+        )
+
+        # Index used to look up all sections for an article
+        cur.execute("CREATE INDEX IF NOT EXISTS section_article ON sections(article)")
+
+        if fulltext:
+            try:
+                # External content table, section text is not duplicated
+                cur.execute(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5(Text, "
+                    "content='sections', content_rowid='Id', tokenize='trigram')"
+                    % Index.FULLTEXT
+                )
+                cur.execute(
+                    "INSERT INTO %s(%s) VALUES('rebuild')"
+                    % (Index.FULLTEXT, Index.FULLTEXT)
+                )
+                print("Built full text index")
+            except sqlite3.OperationalError as e:
+                # FTS5 trigram tokenizer requires SQLite 3.34+
+                print("Skipping full text index: %s" % e)
+
+        db.commit()
+        db.close()
+
+    @staticmethod
+    def filtered(name, labels):
+        """
+        Evaluate section label and name filters for a single section.
+
+        Args:
+            name: section name
+            labels: section labels
+
+        Returns:
+            1 if section should be indexed, 0 otherwise
+        """
+        return int(
+            (labels is None or labels not in ("FRAGMENT", "QUESTION"))
+            and (not name or not re.search(Index.SECTION_FILTER, name.lower()))
+        )
+
+    @staticmethod
+    def indexable(cur):
+        """
+        Check if the sections table has a precomputed indexable column.
+
+        Args:
+            cur: database cursor
+
+        Returns:
+            True if sections have an indexable column
+        """
+        cur.execute("PRAGMA table_info(sections)")
+        return any(row[1].lower() == "indexable" for row in cur.fetchall())
+
     @staticmethod
-    def stream(dbfile, maxsize):
+    def fulltext(cur):
+        """
+        Check if the database has a full text index over section text.
+
+        Args:
+            cur: database cursor
+
+        Returns:
+            True if a full text index exists
+        """
+        cur.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+            [Index.FULLTEXT],
+        )
+        return cur.fetchone() is not None
+
+    @staticmethod
+    def stream(dbfile, maxsize, workers=0, entry=None):
         """
         Stream documents from an articles.sqlite file.
 
-        This method is a generator and will yield a row at time.
+        This method is a generator and will yield a row at time. When workers is
+        greater than 1, section filtering and tokenization run in a process pool.
+        Rows are sent to the pool in chunks and results are yielded in database
+        order, so output is identical to a serial run.
 
         Args:
             dbfile: input SQLite file
             maxsize: maximum number of documents to process
+            workers: number of tokenization processes, runs serially if <= 1
+            entry: only stream sections for articles with an entry date after this value
         """
         # Connection to database file
         db = sqlite3.connect(dbfile)
         cur = db.cursor()
 
         # Select tagged sentences without a NLP label. NLP labels are set for
-        # non-informative sentences.
-        query = Index.SECTION_QUERY + " AND tags is not null"
+        # non-informative sentences. Use precomputed section filter, if available.
+        query = (
+            Index.INDEXABLE_QUERY if Index.indexable(cur) else Index.SECTION_QUERY
+        ) + " AND tags is not null"
 
         if maxsize > 0:
             query += (
@@ -51,33 +433,95 @@ class Index:
                 % maxsize
             )
 
+        args = []
+        if entry:
+            query += " AND article in (SELECT id FROM articles WHERE entry > ?)"
+            args.append(entry)
+
         # Run the query
-        cur.execute(query)
+        cur.execute(query, args)
 
         count = 0
-        for row in cur:
-            # Unpack row
-            uid, name, text = row
+        for uid, tokens in (
+            Index.parallel(cur, workers) if workers > 1 else Index.serial(cur)
+        ):
+            document = (uid, tokens, None)
 
-            if not name or not re.search(Index.SECTION_FILTER, name.lower()):
-                # Tokenize text
-                tokens = Tokenizer.tokenize(text)
+            count += 1
+            if count % 1000 == 0:
+                print("Streamed %d documents" % (count), end="\r")
 
-                document = (uid, tokens, None)
-
-                count += 1
-                if count % 1000 == 0:
-                    print("Streamed %d documents" % (count), end="\r")
-
-                # Skip documents with no tokens parsed
-                if tokens:
-                    yield document
+            # Skip documents with no tokens parsed
+            if tokens:
+                yield document
 
         print("Iterated over %d total rows" % (count))
 
         # Free database resources
         db.close()
 
+    @staticmethod
+    def chunks(cur, size):
+        """
+        Read rows from a database cursor in chunks.
+
+        Args:
+            cur: database cursor
+            size: number of rows per chunk
+
+        Returns:
+            generator of row lists
+        """
+        rows = cur.fetchmany(size)
+        while rows:
+            yield rows
+            rows = cur.fetchmany(size)
+
+    @staticmethod
+    def serial(cur):
+        """
+        Filter and tokenize rows in the current process.
+
+        Args:
+            cur: database cursor
+
+        Returns:
+            generator of (id, tokens)
+        """
+        for rows in Index.chunks(cur, Index.CHUNK_SIZE):
+            yield from tokenize(rows)
+
+    @staticmethod
+    def parallel(cur, workers):
+        """
+        Filter and tokenize rows using a process pool.
+
+        At most workers * 2 chunks are in flight at a time, which bounds memory
+        use when the pool is faster than the consumer. Results are yielded in
+        submission order.
+
+        Args:
+            cur: database cursor
+            workers: number of processes
+
+        Returns:
+            generator of (id, tokens)
+        """
+        with Pool(workers) as pool:
+            # Bounded queue of pending chunk results
+            queue = deque()
+
+            for rows in Index.chunks(cur, Index.CHUNK_SIZE):
+                queue.append(pool.apply_async(tokenize, (rows,)))
+
+                # Wait on the oldest chunk once the queue is full
+                if len(queue) >= workers * 2:
+                    yield from queue.popleft().get()
+
+            # Drain remaining chunks
+            while queue:
+                yield from queue.popleft().get()
+
     @staticmethod
     def config(vectors):
         """
@@ -101,14 +545,21 @@ class Index:
         return {"path": vectors, "scoring": "bm25", "pca": 3, "quantize": True}
 
     @staticmethod
-    def embeddings(dbfile, vectors, maxsize):
+    def embeddings(dbfile, vectors, maxsize, spill=True, workers=0, checkpoint=None):
         """
         Build a sentence embeddings index.
 
+        When spill is enabled and a scoring method is configured, the database is
+        streamed and tokenized once into a token spill file. Both the scoring pass
+        and the vector indexing pass then read from the spill.
+
         Args:
             dbfile: input SQLite file
             vectors: path to vectors file or configuration
             maxsize: maximum number of documents to process
+            spill: tokenize once into a spill file shared by all passes
+            workers: number of tokenization processes, runs serially if <= 1
+            checkpoint: optional Checkpoint, persists build progress
 
         Returns:
             embeddings index
@@ -116,24 +567,462 @@ class Index:
         # Read config and create Embeddings instance
         embeddings = Embeddings(Index.config(vectors))
 
+        # Elapsed time per build pass
+        timings = []
+
+        if checkpoint:
+            Index.checkpointed(
+                embeddings, dbfile, maxsize, workers, checkpoint, timings
+            )
+            Index.timings(timings)
+            return embeddings
+
+        # Single pass over the database, only required when running multiple passes
+        tokens = None
+        if spill and embeddings.config.get("scoring"):
+            start = time.time()
+            tokens = Tokens(Index.stream(dbfile, maxsize, workers))
+            timings.append(("tokenize", time.time() - start))
+
+        try:
+            # Build scoring index if scoring method provided
+            if embeddings.config.get("scoring"):
+                start = time.time()
+                embeddings.score(
+                    tokens
+                    if tokens is not None
+                    else Index.stream(dbfile, maxsize, workers)
+                )
+                timings.append(("score", time.time() - start))
+
+            # Build embeddings index
+            start = time.time()
+            embeddings.index(
+                tokens if tokens is not None else Index.stream(dbfile, maxsize, workers)
+            )
+            timings.append(("index", time.time() - start))
+        finally:
+            # Remove spill file
+            if tokens is not None:
+                tokens.close()
+
+        Index.timings(timings)
+
+        return embeddings
+
+    @staticmethod
+    def checkpointed(embeddings, dbfile, maxsize, workers, checkpoint, timings):
+        """
+        Build a sentence embeddings index, persisting progress to a checkpoint.
+
+        The token spill and scoring state are saved once complete. Vectors are
+        saved every CHECKPOINT_SIZE documents. Completed work found in the
+        checkpoint is skipped.
+
+        Args:
+            embeddings: embeddings instance
+            dbfile: input SQLite file
+            maxsize: maximum number of documents to process
+            workers: number of tokenization processes, runs serially if <= 1
+            checkpoint: Checkpoint
+            timings: list of (pass name, elapsed seconds) to append to
+        """
+        # Tokenize pass
+        if checkpoint.state["tokens"] is None:
+            start = time.time()
+            tokens = Tokens(
+                Index.stream(dbfile, maxsize, workers), checkpoint.file("tokens")
+            )
+            checkpoint.update(tokens=len(tokens))
+            timings.append(("tokenize", time.time() - start))
+        else:
+            tokens = Tokens(
+                path=checkpoint.file("tokens"), count=checkpoint.state["tokens"]
+            )
+
         # Build scoring index if scoring method provided
-        if embeddings.config.get("scoring"):
-            embeddings.score(Index.stream(dbfile, maxsize))
+        if embeddings.scoring:
+            if checkpoint.state["scoring"]:
+                embeddings.scoring.load(checkpoint.path)
+            else:
+                start = time.time()
+                embeddings.score(tokens)
+                embeddings.scoring.save(checkpoint.path)
+                checkpoint.update(scoring=True)
+                timings.append(("score", time.time() - start))
+
+        if checkpoint.state["documents"]:
+            print(
+                "Resuming after document %d (id %s)"
+                % (checkpoint.state["documents"], checkpoint.state["uid"])
+            )
+
+        # Transform remaining documents to vectors in batches
+        start = time.time()
+        documents = itertools.islice(tokens, checkpoint.state["documents"], None)
+        batch = list(itertools.islice(documents, Index.CHECKPOINT_SIZE))
+        while batch:
+            ids, _, vectors = embeddings.vectors(batch)
+            checkpoint.write(ids, vectors)
+
+            print("Checkpointed %d documents" % checkpoint.state["documents"])
+            batch = list(itertools.islice(documents, Index.CHECKPOINT_SIZE))
+
+        timings.append(("vectors", time.time() - start))
+
+        # Build embeddings index from all vector batches
+        start = time.time()
+        ids, vectors = checkpoint.read()
+        if not ids:
+            raise ValueError("No documents found to index")
+
+        Index.finalize(embeddings, ids, vectors)
+        timings.append(("index", time.time() - start))
+
+    @staticmethod
+    def finalize(embeddings, ids, vectors):
+        """
+        Build an embeddings index from precomputed document vectors. Runs the same
+        steps as Embeddings.index after vectors are generated.
+
+        Args:
+            embeddings: embeddings instance
+            ids: document ids
+            vectors: document vectors
+        """
+        Index.reduce(embeddings, vectors)
+        Index.ann(embeddings, ids, vectors)
+
+    @staticmethod
+    def reduce(embeddings, vectors):
+        """
+        Build the LSA model (if enabled) and normalize document vectors. Vectors are
+        modified in place.
+
+        Args:
+            embeddings: embeddings instance
+            vectors: document vectors
+        """
+        # Build LSA model (if enabled). Remove principal components from embeddings.
+        if embeddings.config.get("pca"):
+            embeddings.reducer = Reducer(vectors, embeddings.config["pca"])
+            embeddings.reducer(vectors)
+
+        # Normalize embeddings
+        embeddings.normalize(vectors)
+
+    @staticmethod
+    def ann(embeddings, ids, vectors):
+        """
+        Build the ANN index over normalized document vectors.
+
+        Args:
+            embeddings: embeddings instance
+            ids: document ids
+            vectors: document vectors
+        """
+        # Save embeddings metadata
+        embeddings.config["ids"] = ids
+        embeddings.config["dimensions"] = vectors.shape[1]
+
+        # Create and build embeddings index
+        embeddings.embeddings = ANNFactory.create(embeddings.config)
+        embeddings.embeddings.index(vectors)
+
+    @staticmethod
+    def timings(timings):
+        """
+        Print a pass-by-pass timing breakdown for an index build.
+
+        Args:
+            timings: list of (pass name, elapsed seconds)
+        """
+        total = sum(elapsed for _, elapsed in timings)
+
+        print("Build timings")
+        for name, elapsed in timings:
+            print(
+                "  %-10s %10.2fs (%5.1f%%)"
+                % (name, elapsed, 100 * elapsed / total if total else 0)
+            )
+        print("  %-10s %10.2fs" % ("total", total))
+
+    @staticmethod
+    def partition(dbfile, shards, method):
+        """
+        Assign each section to a shard.
+
+        Sections are partitioned by article, so all sections for an article are in
+        the same shard. The "hash" method assigns articles by a hash of the article
+        id. The "date" method sorts articles by publication date and splits them
+        into contiguous date ranges of equal size.
+
+        Args:
+            dbfile: input SQLite file
+            shards: number of shards
+            method: partition method, "hash" or "date"
+
+        Returns:
+            {section id: shard}
+        """
+        db = sqlite3.connect(dbfile)
+
+        # Article to shard mapping for date range partitions
+        lookup = None
+        if method == "date":
+            articles = [
+                uid
+                for (uid,) in db.execute(
+                    "SELECT id FROM articles ORDER BY published, id"
+                )
+            ]
+
+            size = max(-(-len(articles) // shards), 1)
+            lookup = {uid: x // size for x, uid in enumerate(articles)}
+
+        assignments = {}
+        for sid, article in db.execute("SELECT id, article FROM sections"):
+            assignments[sid] = (
+                lookup.get(article, 0)
+                if lookup is not None
+                else zlib.crc32(str(article).encode()) % shards
+            )
+
+        db.close()
+
+        return assignments
+
+    @staticmethod
+    def sharded(path, dbfile, vectors, maxsize, workers, shards, method):
+        """
+        Build a sharded sentence embeddings index.
+
+        Each shard is saved as its own embeddings index in path. Documents are
+        tokenized and transformed to vectors once. The scoring index and LSA model
+        are built once over all documents and shared by every shard, so shard
+        search scores are comparable.
+
+        Args:
+            path: shards directory
+            dbfile: input SQLite file
+            vectors: path to vectors file or configuration
+            maxsize: maximum number of documents to process
+            workers: number of tokenization processes, runs serially if <= 1
+            shards: number of shards
+            method: partition method, "hash" or "date"
+        """
+        assignments = Index.partition(dbfile, shards, method)
+
+        embeddings = Embeddings(Index.config(vectors))
+
+        # Single pass over the database
+        tokens = Tokens(Index.stream(dbfile, maxsize, workers))
+
+        try:
+            # Build global scoring index
+            if embeddings.scoring:
+                embeddings.score(tokens)
+
+            # Transform all documents to vectors
+            ids, _, data = embeddings.vectors(tokens)
+        finally:
+            tokens.close()
+
+        # Build global LSA model
+        Index.reduce(embeddings, data)
+
+        # Remove shards from a previous build
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.makedirs(path)
+
+        # Shard for each document
+        labels = np.array([assignments[uid] for uid in ids])
+
+        for shard in range(shards):
+            rows = np.flatnonzero(labels == shard)
+
+            # Skip empty shards
+            if not rows.size:
+                continue
+
+            print("Building shard %d with %d documents" % (shard, rows.size))
+
+            # Shards share the vectors model, scoring index and LSA model
+            part = copy.copy(embeddings)
+            part.config = copy.deepcopy(embeddings.config)
+
+            Index.ann(part, [ids[x] for x in rows], data[rows])
+            part.save(os.path.join(path, str(shard)))
+
+    @staticmethod
+    def entry(dbfile):
+        """
+        Get the latest article entry date, used as the high-water mark for
+        incremental index updates.
+
+        Args:
+            dbfile: input SQLite file
+
+        Returns:
+            max entry date
+        """
+        db = sqlite3.connect(dbfile)
+        entry = db.execute("SELECT MAX(entry) FROM articles").fetchone()[0]
+        db.close()
+
+        return entry
+
+    @staticmethod
+    def state(path):
+        """
+        Load the build state stored alongside an index.
+
+        Args:
+            path: model path
+
+        Returns:
+            build state dict, None if no state is available
+        """
+        statefile = os.path.join(path, Index.STATE)
+        if os.path.isfile(statefile):
+            with open(statefile, "r", encoding="utf-8") as f:
+                return yaml.safe_load(f)
+
+        return None
+
+    @staticmethod
+    def save(path, config, entry, shards=0):
+        """
+        Save the build state alongside an index.
 
-        # Build embeddings index
-        embeddings.index(Index.stream(dbfile, maxsize))
+        Args:
+            path: model path
+            config: index configuration used for the build
+            entry: high-water mark entry date of indexed articles
+            shards: number of index shards, 0 if not sharded
+        """
+        with open(os.path.join(path, Index.STATE), "w", encoding="utf-8") as f:
+            yaml.safe_dump({"config": config, "entry": entry, "shards": shards}, f)
+
+    @staticmethod
+    def write(embeddings, path):
+        """
+        Save an embeddings index to a model path.
+
+        Files are saved to a temporary directory in path and then moved into place.
+        Replaced files keep their data until closed, so processes that memory map
+        the current index keep reading a consistent copy while it is rebuilt. The
+        index configuration is moved last, its modification time marks a new index
+        version.
+
+        Args:
+            embeddings: embeddings index
+            path: model path
+        """
+        staging = tempfile.mkdtemp(prefix=".index", dir=path)
+
+        try:
+            embeddings.save(staging)
+
+            for name in sorted(os.listdir(staging), key=lambda x: x == CONFIG_NAME):
+                os.replace(os.path.join(staging, name), os.path.join(path, name))
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    @staticmethod
+    def update(path, dbfile, entry, workers=0):
+        """
+        Append sections for articles added since the last build to an existing
+        index.
+
+        The scoring model and dimensionality reduction model of the existing index
+        are reused as is, so new vectors are consistent with existing vectors.
+
+        Args:
+            path: model path
+            dbfile: input SQLite file
+            entry: high-water mark entry date of indexed articles
+            workers: number of tokenization processes, runs serially if <= 1
+
+        Returns:
+            embeddings index, None if the index backend doesn't support appends
+        """
+        embeddings = Embeddings()
+        embeddings.load(path)
+
+        # Skip sections already in the index
+        indexed = set(embeddings.config["ids"])
+        tokens = Tokens(
+            document
+            for document in Index.stream(dbfile, 0, workers, entry)
+            if document[0] not in indexed
+        )
+
+        try:
+            print("Appending %d new documents" % len(tokens))
+            if len(tokens):
+                # Transform new documents to embeddings vectors
+                ids, _, vectors = embeddings.vectors(tokens)
+
+                # Apply existing LSA model and normalize, same as a full build
+                if embeddings.reducer:
+                    embeddings.reducer(vectors)
+                embeddings.normalize(vectors)
+
+                # Append vectors to the ANN index
+                embeddings.embeddings.append(vectors)
+                embeddings.config["ids"] = embeddings.config["ids"] + ids
+        except NotImplementedError:
+            return None
+        finally:
+            tokens.close()
 
         return embeddings
 
     @staticmethod
-    def run(path, vectors, maxsize=0):
+    def run(
+        path,
+        vectors,
+        maxsize=0,
+        spill=True,
+        workers=0,
+        incremental=False,
+        resume=False,
+        shards=0,
+        partition="hash",
+        fulltext=False,
+        checkpoint=False,
+    ):
         """
         Execute an index run.
 
+        When incremental is set, only sections for articles with an entry date after
+        the last build are indexed and appended to the existing index. A full
+        rebuild runs instead if there is no existing index, the index configuration
+        changed or the index backend doesn't support appends.
+
+        When checkpoint is set, full builds with spill enabled write checkpoints to
+        a checkpoint directory in the model path. If a build is interrupted, running
+        again with resume set continues from the last checkpoint.
+
+        When shards is greater than 1, sections are partitioned into shards that
+        are each saved as a separate embeddings index. Sharded builds always run a
+        full rebuild.
+
         Args:
             path: model path, if None uses default path
             vectors: path to vectors file or configuration, if None uses default path
             maxsize: maximum number of documents to process
+            spill: tokenize once into a spill file shared by all build passes
+            workers: number of tokenization processes, runs serially if <= 1
+            incremental: append new articles to an existing index if possible
+            resume: continue an interrupted build from its last checkpoint
+            shards: number of index shards, builds a single index if <= 1
+            partition: shard partition method, "hash" (article id) or "date"
+                       (publication date range)
+            fulltext: build a full text index used to filter query tokens
+            checkpoint: persist build progress, implied by resume
         """
         # Default path if not provided
         if not path:
@@ -141,9 +1030,72 @@ class Index:
 
         dbfile = os.path.join(path, "articles.sqlite")
 
-        print("Building new model")
-        embeddings = Index.embeddings(dbfile, vectors, maxsize)
-        embeddings.save(path)
+        # Precompute section filters
+        Index.prepare(dbfile, fulltext)
+
+        # Index configuration and current high-water mark
+        config, entry = Index.config(vectors), Index.entry(dbfile)
+
+        if shards > 1:
+            print("Building new model with %d shards" % shards)
+            Index.sharded(
+                os.path.join(path, SHARDS_NAME),
+                dbfile,
+                vectors,
+                maxsize,
+                workers,
+                shards,
+                partition,
+            )
+
+            # Remove single index files from a previous build
+            for name in Index.FILES:
+                if os.path.exists(os.path.join(path, name)):
+                    os.remove(os.path.join(path, name))
+
+            Index.save(path, config, entry, shards)
+            return
+
+        embeddings = None
+        if incremental:
+            state = Index.state(path)
+            if (
+                state
+                and state.get("config") == config
+                and state.get("entry")
+                and not state.get("shards")
+            ):
+                print("Updating model with articles after %s" % state["entry"])
+                embeddings = Index.update(path, dbfile, state["entry"], workers)
+            else:
+                print("Index configuration changed or no prior build found")
+
+        progress = None
+        if not embeddings:
+            if spill and (checkpoint or resume):
+                progress = Checkpoint(
+                    os.path.join(path, "checkpoint"), config, maxsize, resume
+                )
+
+                # Keep high-water mark from when the build started
+                entry = progress.state["entry"] or entry
+                progress.update(entry=entry)
+
+            print("Building new model")
+            embeddings = Index.embeddings(
+                dbfile, vectors, maxsize, spill, workers, progress
+            )
+
+        Index.write(embeddings, path)
+        Index.save(path, config, entry)
+
+        # Remove shards from a previous build
+        if os.path.exists(os.path.join(path, SHARDS_NAME)):
+            shutil.rmtree(os.path.join(path, SHARDS_NAME))
+
+        # Build complete, remove checkpoint
+        if progress:
+            progress.clear()
 
 
 if __name__ == "__main__":
@@ -151,4 +1103,5 @@ if __name__ == "__main__":
         sys.argv[1] if len(sys.argv) > 1 else None,
         sys.argv[2] if len(sys.argv) > 2 else None,
         int(sys.argv[3]) if len(sys.argv) > 3 else 0,
+        workers=int(sys.argv[4]) if len(sys.argv) > 4 else 0,
     )
@@ -5,13 +5,21 @@ Models module
 import logging
 import os
 import os.path
+import pickle
 import sqlite3
 from pathlib import Path
 
+import faiss
+from txtai.ann import ANNFactory, Faiss
 from txtai.embeddings import Embeddings
+from txtai.embeddings.reducer import Reducer
+from txtai.scoring import ScoringFactory
+
+from .shards import Shards
 
 ARTICLES_SQLITE_NAME = "articles.sqlite"
 CONFIG_NAME = "config"
+SHARDS_NAME = "shards"
 
 
 class Models:
@@ -19,6 +27,12 @@ class Models:
     Common methods for generating data paths.
     """
 
+    # Memory mapped I/O size for read connections, in bytes
+    MMAP_SIZE = 256 * 1024 * 1024
+
+    # Page cache size for read connections, negative values are in KB
+    CACHE_SIZE = -64 * 1024
+
     @staticmethod
     def basePath(create=False):
         """
@@ -79,6 +93,142 @@ class Models:
         # Append file name to path
         return os.path.join(path, name)
 
+    @staticmethod
+    def embeddings(path, mmap=False):
+        """
+        Load an embeddings index.
+
+        Args:
+            path: model path
+            mmap: memory map the ANN index read-only, see Models.mmap
+
+        Returns:
+            Embeddings, Shards if the index is sharded or None if no index is found
+        """
+        path = str(path)
+
+        if os.path.isfile(os.path.join(path, CONFIG_NAME)):
+            logging.info("Loading model from %s" % path)
+            if mmap:
+                return Models.mapped(path)
+
+            embeddings = Embeddings()
+            embeddings.load(path)
+            return embeddings
+
+        if os.path.isdir(os.path.join(path, SHARDS_NAME)):
+            logging.info("Loading sharded model from %s" % path)
+            shards = Shards()
+
+            # Shards reuse the vectors, scoring and LSA models of the first shard
+            for shard in Shards.paths(os.path.join(path, SHARDS_NAME)):
+                shards.shards.append(
+                    Models.read(
+                        shard, mmap, shards.shards[0] if shards.shards else None
+                    )
+                )
+
+            return shards
+
+        return None
+
+    @staticmethod
+    def mapped(path):
+        """
+        Load an embeddings index with the ANN index memory mapped read-only.
+
+        Args:
+            path: model path
+
+        Returns:
+            Embeddings
+        """
+        return Models.read(path, True)
+
+    @staticmethod
+    def read(path, mmap=False, shared=None):
+        """
+        Load an embeddings index.
+
+        Follows the same steps as Embeddings.load. With mmap, the ANN index is loaded
+        with Models.mmap. With shared, the vectors, scoring and LSA models of another
+        index built with the same models are reused instead of loaded again.
+
+        Args:
+            path: model path
+            mmap: memory map the ANN index read-only
+            shared: optional embeddings index to share models with
+
+        Returns:
+            Embeddings
+        """
+        embeddings = Embeddings()
+
+        # Index configuration
+        with open(os.path.join(path, CONFIG_NAME), "rb") as handle:
+            embeddings.config = pickle.load(handle)
+
+            # Build full path to embedding vectors file
+            if embeddings.config.get("storevectors"):
+                embeddings.config["path"] = os.path.join(
+                    path, embeddings.config["path"]
+                )
+
+        # Sentence embeddings index
+        embeddings.embeddings = ANNFactory.create(embeddings.config)
+        if mmap:
+            Models.mmap(embeddings.embeddings, os.path.join(path, "embeddings"))
+        else:
+            embeddings.embeddings.load(os.path.join(path, "embeddings"))
+
+        if shared:
+            embeddings.reducer = shared.reducer
+            embeddings.scoring = shared.scoring
+            embeddings.model = shared.model
+            return embeddings
+
+        # Dimensionality reduction
+        if embeddings.config.get("pca"):
+            embeddings.reducer = Reducer()
+            embeddings.reducer.load(path)
+
+        # Embedding scoring
+        if embeddings.config.get("scoring"):
+            embeddings.scoring = ScoringFactory.create(embeddings.config["scoring"])
+            embeddings.scoring.load(path)
+
+        # Sentence vectors model
+        embeddings.model = embeddings.loadVectors()
+
+        return embeddings
+
+    @staticmethod
+    def mmap(ann, path):
+        """
+        Load an ANN index file. Faiss indexes are memory mapped read-only, so
+        processes that load the same index share its pages through the page cache
+        instead of each holding a private copy. Faiss maps the inverted lists of IVF
+        indexes, which are used for indexes with 5000+ sections. Index builds replace
+        index files instead of writing over them (see Index.write), so mapped files
+        stay valid while an index is rebuilt.
+
+        Other backends and indexes that can't be mapped are loaded into memory.
+
+        Args:
+            ann: ANN instance
+            path: ANN index file
+        """
+        if isinstance(ann, Faiss):
+            try:
+                ann.model = faiss.read_index(
+                    path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+                )
+                return
+            except RuntimeError as e:
+                logging.warning("Unable to memory map index %s: %s" % (path, e))
+
+        ann.load(path)
+
     @staticmethod
     def load(path):
         """
@@ -96,25 +246,21 @@ class Models:
 
         dbfile = os.path.join(path, "articles.sqlite")
 
-        if os.path.isfile(os.path.join(path, "config")):
-            logging.info(f"Loading model from {path}")
-            embeddings = Embeddings()
-            embeddings.load(path)
-        else:
-            embeddings = None
+        embeddings = Models.embeddings(path)
 
         # Connect to database file
-        db = sqlite3.connect(dbfile)
+        db = Models.connect(dbfile)
 
         return (embeddings, db)
 
     @staticmethod
-    def load_path(path: Path):
+    def load_path(path: Path, mmap: bool = False):
         """
         Load an embeddings model and db database.
 
         Args:
             path: model path, if None uses default path
+            mmap: memory map the ANN index read-only, see Models.mmap
 
         Returns:
             (embeddings, db handle)
@@ -125,23 +271,38 @@ class Models:
             )
 
         articles_path = path / ARTICLES_SQLITE_NAME
-        config_path = path / CONFIG_NAME
 
-        # dbfile = os.path.join(path, "articles.sqlite")
-
-        # if os.path.isfile(os.path.join(path, "config")):
-        if config_path.is_file():
-            logging.info("Loading model from %s" % path)
-            embeddings = Embeddings()
-            embeddings.load(str(path))
-        else:
-            embeddings = None
+        embeddings = Models.embeddings(path, mmap)
 
         # Connect to database file
-        db = sqlite3.connect(articles_path)
+        db = Models.connect(articles_path)
 
         return (embeddings, db)
 
+    @staticmethod
+    def connect(dbfile, check_same_thread=True):
+        """
+        Open a read-only database connection tuned for queries.
+
+        The database is opened in read-only mode with query_only set, so any write
+        fails. Reads use memory mapped I/O and a larger page cache.
+
+        Args:
+            dbfile: SQLite file
+            check_same_thread: only allow the creating thread to use the connection
+
+        Returns:
+            db handle
+        """
+        uri = "%s?mode=ro" % Path(os.path.abspath(dbfile)).as_uri()
+        db = sqlite3.connect(uri, uri=True, check_same_thread=check_same_thread)
+
+        db.execute("PRAGMA query_only = ON")
+        db.execute("PRAGMA mmap_size = %d" % Models.MMAP_SIZE)
+        db.execute("PRAGMA cache_size = %d" % Models.CACHE_SIZE)
+
+        return db
+
     @staticmethod
     def close(db):
         """
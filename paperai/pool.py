@@ -0,0 +1,102 @@
+"""
+Pool module
+"""
+
+import queue
+import threading
+from contextlib import contextmanager
+
+from .models import Models
+
+
+class Pool:
+    """
+    Thread-safe pool of read-only database connections.
+
+    Connections are opened on demand up to the pool size and reused across threads.
+    When all connections are in use, callers wait for one to be returned.
+    """
+
+    def __init__(self, dbfile, size=8):
+        """
+        Create a new connection pool.
+
+        Args:
+            dbfile: SQLite file
+            size: maximum number of open connections
+        """
+        self.dbfile = dbfile
+        self.size = size
+
+        # Idle connections, most recently used first
+        self.connections = queue.LifoQueue()
+
+        self.opened = 0
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a connection from the pool for the duration of a with block.
+
+        Returns:
+            db handle
+        """
+        db = self.acquire()
+        try:
+            yield db
+        finally:
+            self.release(db)
+
+    def acquire(self):
+        """
+        Take a connection from the pool, opening a new connection if none are idle
+        and the pool isn't full.
+
+        Returns:
+            db handle
+        """
+        try:
+            return self.connections.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self.lock:
+            opened = self.opened < self.size
+            if opened:
+                self.opened += 1
+
+        if opened:
+            try:
+                return Models.connect(self.dbfile, check_same_thread=False)
+            except Exception:
+                with self.lock:
+                    self.opened -= 1
+                raise
+
+        # Wait for a connection to be returned
+        return self.connections.get()
+
+    def release(self, db):
+        """
+        Return a connection to the pool.
+
+        Args:
+            db: db handle
+        """
+        self.connections.put(db)
+
+    def close(self):
+        """
+        Close all idle connections.
+        """
+        while True:
+            try:
+                db = self.connections.get_nowait()
+            except queue.Empty:
+                break
+
+            with self.lock:
+                self.opened -= 1
+
+            Models.close(db)
@@ -3,6 +3,7 @@ Query module
 """
 
 import datetime
+import logging
 import re
 import sys
 
@@ -10,8 +11,11 @@ import html2markdown
 import mdv
 from txtai.pipeline import Tokenizer
 
+from .cache import CACHE
 from .highlights import Highlights
-from .models import Models
+from .index import Index
+from .registry import REGISTRY
+from .utils import Article
 
 
 class Query:
@@ -19,6 +23,19 @@ class Query:
     Methods to query an embeddings index.
     """
 
+    # Maximum number of ids bound to a single IN (...) lookup query
+    BATCH_SIZE = 500
+
+    # Minimum number of search candidates retrieved per requested result
+    CANDIDATES = 5
+
+    # Maximum number of search candidates retrieved per requested result
+    OVERFETCH = 50
+
+    # Sections matching required tokens are scored directly when there are at most
+    # this many, instead of searching the full index
+    RESCORE = 500
+
     @staticmethod
     def markdown(text):
         """
@@ -105,6 +122,16 @@ class Query:
 
         Each returned result is resolved to the full section row.
 
+        The search starts with topn * CANDIDATES candidates. Queries with required
+        or prohibited tokens then double the candidate pool until topn distinct
+        articles pass the filters, the index has no more matches at or above
+        threshold or topn * OVERFETCH candidates have been retrieved.
+
+        If the database has a full text index, sections with rare required and
+        prohibited tokens are looked up first. When few sections contain all the
+        required tokens, they are scored directly against the query. Sections with
+        rare prohibited tokens are skipped before candidates are resolved.
+
         Args:
             embeddings: embeddings model
             cur: database cursor
@@ -115,73 +142,464 @@ class Query:
         Returns:
             search results
         """
-        if query == "*":
-            return []
+        return Query.batchsearch(embeddings, cur, [query], topn, threshold)[0]
 
-        # Default threshold if None
-        threshold = threshold if threshold is not None else 0.6
+    @staticmethod
+    def batchsearch(embeddings, cur, queries, topn, threshold):
+        """
+        Execute an embeddings search for a list of queries.
 
-        results = []
+        Returns the same results as running Query.search for each query. Each round
+        retrieves candidates for all remaining queries with a single batched
+        embeddings search and resolves hits for all queries with shared section
+        lookups.
 
-        # Get list of required and prohibited tokens
-        must = [
-            token.strip("+")
-            for token in query.split()
-            if token.startswith("+") and len(token) > 1
-        ]
-        mnot = [
-            token.strip("-")
-            for token in query.split()
-            if token.startswith("-") and len(token) > 1
-        ]
+        Args:
+            embeddings: embeddings model
+            cur: database cursor
+            queries: list of query text
+            topn: number of documents to return per query
+            threshold: require at least this score to include result
+
+        Returns:
+            list of search results per query
+        """
+        # Default threshold if None
+        threshold = threshold if threshold is not None else 0.6
 
-        # Tokenize search query
-        query = Tokenizer.tokenize(query)
+        results = [[] for _ in queries]
+
+        # Search state for queries that need an embeddings search
+        active = []
+
+        for x, query in enumerate(queries):
+            if query == "*":
+                continue
+
+            # Get list of required and prohibited tokens
+            must = [
+                token.strip("+")
+                for token in query.split()
+                if token.startswith("+") and len(token) > 1
+            ]
+            mnot = [
+                token.strip("-")
+                for token in query.split()
+                if token.startswith("-") and len(token) > 1
+            ]
+
+            # Tokenize search query
+            query = Tokenizer.tokenize(query)
+
+            # Look up sections with required and prohibited tokens
+            allowed, forbidden = Query.fulltext(cur, must, mnot)
+            if allowed is not None:
+                results[x] = Query.rescore(
+                    embeddings,
+                    cur,
+                    query,
+                    allowed - forbidden,
+                    max(topn, 1) * Query.CANDIDATES,
+                    threshold,
+                    must,
+                    mnot,
+                )
+            else:
+                active.append(
+                    {
+                        "index": x,
+                        "query": query,
+                        "must": must,
+                        "mnot": mnot,
+                        "forbidden": forbidden,
+                        # Processed section ids and distinct articles with a
+                        # matching section
+                        "seen": set(),
+                        "articles": set(),
+                        "limit": max(topn, 1) * Query.CANDIDATES,
+                        "rounds": 0,
+                    }
+                )
 
-        # Retrieve topn * 5 to account for duplicate matches
-        for uid, score in embeddings.search(query, topn * 5):
-            if score >= threshold:
-                cur.execute("SELECT Article, Text FROM sections WHERE id = ?", [uid])
+        maximum = max(topn, 1) * Query.OVERFETCH
+        while active:
+            candidates = Query.candidates(
+                embeddings,
+                [state["query"] for state in active],
+                max(state["limit"] for state in active),
+            )
 
-                # Get matching row
-                sid, text = cur.fetchone()
+            for state, matches in zip(active, candidates):
+                state["rounds"] += 1
+                state["candidates"] = matches[: state["limit"]]
+
+                # Only process hits not already processed in a prior round
+                state["hits"] = [
+                    (uid, score)
+                    for uid, score in state["candidates"]
+                    if uid not in state["seen"]
+                    and score >= threshold
+                    and uid not in state["forbidden"]
+                ]
+                state["seen"].update(uid for uid, _ in state["hits"])
+
+            # Resolve all hits to section rows
+            sections = Query.sections(
+                cur, list({uid for state in active for uid, _ in state["hits"]})
+            )
 
-                # Add result if:
-                #   - all required tokens are present or there are not required
-                # tokens AND    - all prohibited tokens are not present or there
-                # are not prohibited tokens
+            remaining = []
+            for state in active:
+                for uid, score in state["hits"]:
+                    # Get matching row
+                    sid, text = sections[uid]
+
+                    # Add result if required tokens are present and prohibited
+                    # tokens are not present
+                    if Query.matches(text, state["must"], state["mnot"]):
+                        # Save result
+                        results[state["index"]].append((uid, score, sid, text))
+                        state["articles"].add(sid)
+
+                # Stop when the query has no token filters, enough articles
+                # matched, the index is exhausted, remaining candidates score below
+                # threshold or the candidate limit is reached
+                limit, matches = state["limit"], state["candidates"]
                 if (
-                    not must or all(token.lower() in text.lower() for token in must)
-                ) and (
-                    not mnot or all(token.lower() not in text.lower() for token in mnot)
+                    not (state["must"] or state["mnot"])
+                    or len(state["articles"]) >= topn
+                    or len(matches) < limit
+                    or (matches and matches[-1][1] < threshold)
+                    or limit >= maximum
                 ):
-                    # Save result
-                    results.append((uid, score, sid, text))
+                    logging.debug(
+                        "Query search retrieved %d candidates in %d round(s) for "
+                        "%d/%d articles",
+                        limit,
+                        state["rounds"],
+                        len(state["articles"]),
+                        topn,
+                    )
+                else:
+                    state["limit"] = min(limit * 2, maximum)
+                    remaining.append(state)
+
+            active = remaining
 
         return results
 
     @staticmethod
-    def highlights(results, topn):
+    def candidates(embeddings, queries, limit):
+        """
+        Get search candidates for a list of tokenized queries.
+
+        Args:
+            embeddings: embeddings model
+            queries: list of query tokens
+            limit: maximum candidates per query
+
+        Returns:
+            list of (id, score) per query
+        """
+        if len(queries) == 1:
+            return [embeddings.search(queries[0], limit)]
+
+        return embeddings.batchsearch(queries, limit)
+
+    @staticmethod
+    def matches(text, must, mnot):
+        """
+        Check if text satisfies required and prohibited token filters.
+
+        Args:
+            text: section text
+            must: required tokens
+            mnot: prohibited tokens
+
+        Returns:
+            True if text matches the filters
+        """
+        # Match if:
+        #   - all required tokens are present or there are not required tokens AND
+        #   - all prohibited tokens are not present or there are not prohibited tokens
+        return (not must or all(token.lower() in text.lower() for token in must)) and (
+            not mnot or all(token.lower() not in text.lower() for token in mnot)
+        )
+
+    @staticmethod
+    def fulltext(cur, must, mnot):
+        """
+        Look up sections with required and prohibited tokens in the full text index.
+
+        Lookups are only used when at most RESCORE sections match, which is the
+        case for rare tokens. Common tokens are left to Query.matches, which checks
+        every search hit.
+
+        The trigram index only matches tokens with 3 or more characters, shorter
+        tokens are ignored here. Results are candidates only, callers still check
+        each section with Query.matches.
+
+        Args:
+            cur: database cursor
+            must: required tokens
+            mnot: prohibited tokens
+
+        Returns:
+            (allowed, forbidden) section ids, allowed is None when the index isn't
+            used to select sections
+        """
+        allowed, forbidden = None, set()
+
+        must = [token for token in must if len(token) >= 3]
+        mnot = [token for token in mnot if len(token) >= 3]
+
+        if (must or mnot) and Index.fulltext(cur):
+            # Sections with all required tokens
+            if must:
+                allowed = Query.match(cur, must, "AND")
+
+            # Sections with any prohibited token
+            if mnot:
+                forbidden = Query.match(cur, mnot, "OR") or set()
+
+        return allowed, forbidden
+
+    @staticmethod
+    def match(cur, tokens, operator):
+        """
+        Get ids of sections matching a list of tokens. At most RESCORE + 1 ids are
+        read from the full text index.
+
+        Args:
+            cur: database cursor
+            tokens: search tokens
+            operator: "AND" to match sections with all tokens, "OR" for any token
+
+        Returns:
+            set of section ids, None if more than RESCORE sections match
+        """
+        # Quote tokens as FTS5 strings to match them as substrings
+        expression = (" %s " % operator).join(
+            '"%s"' % token.replace('"', '""') for token in tokens
+        )
+
+        cur.execute(
+            "SELECT rowid FROM %s WHERE %s MATCH ? LIMIT ?"
+            % (Index.FULLTEXT, Index.FULLTEXT),
+            [expression, Query.RESCORE + 1],
+        )
+        uids = {row[0] for row in cur.fetchall()}
+
+        return uids if len(uids) <= Query.RESCORE else None
+
+    @staticmethod
+    def rescore(embeddings, cur, query, uids, limit, threshold, must, mnot):
+        """
+        Score a set of sections directly against the query. Returns at most limit
+        results, the same as an embeddings search.
+
+        Args:
+            embeddings: embeddings model
+            cur: database cursor
+            query: query tokens
+            uids: section ids
+            limit: maximum number of results
+            threshold: require at least this score to include result
+            must: required tokens
+            mnot: prohibited tokens
+
+        Returns:
+            search results
+        """
+        # Resolve sections, skipping sections excluded from the embeddings index
+        sections = Query.sections(cur, sorted(uids), True)
+
+        # Only score sections that pass the token filters
+        uids = [uid for uid in sections if Query.matches(sections[uid][1], must, mnot)]
+
+        # Sections without tokens are not indexed
+        tokens = {uid: Tokenizer.tokenize(sections[uid][1]) for uid in uids}
+        uids = [uid for uid in uids if tokens[uid]]
+        if not uids:
+            return []
+
+        scores = embeddings.similarity(query, [tokens[uid] for uid in uids])
+
+        return [
+            (uids[x], score, *sections[uids[x]])
+            for x, score in scores[:limit]
+            if score >= threshold
+        ]
+
+    @staticmethod
+    def sections(cur, uids, indexable=False):
+        """
+        Get article id and text for a list of section ids.
+
+        Sections are selected in batches, with one query per batch.
+
+        Args:
+            cur: database cursor
+            uids: list of section ids
+            indexable: only return sections selected for indexing by Index.stream,
+                       requires a database prepared with Index.prepare. Sections
+                       added after the last Index.prepare run are evaluated with
+                       the section filter.
+
+        Returns:
+            {section id: (article id, text)}
+        """
+        sections = {}
+        for x in range(0, len(uids), Query.BATCH_SIZE):
+            batch = uids[x : x + Query.BATCH_SIZE]
+            cur.execute(
+                "SELECT Id, Article, Text, %s FROM sections WHERE %sid IN (%s)"
+                % (
+                    Index.INDEXABLE_NAME if indexable else "NULL",
+                    (
+                        "%s AND tags is not null AND " % Index.INDEXABLE_FILTER
+                        if indexable
+                        else ""
+                    ),
+                    ",".join(["?"] * len(batch)),
+                ),
+                batch,
+            )
+
+            # Name is only set for indexable sections not yet evaluated, labels are
+            # already filtered in the query
+            for uid, article, text, name in cur.fetchall():
+                if not name or Index.filtered(name, None):
+                    sections[uid] = (article, text)
+
+        return sections
+
+    @staticmethod
+    def articles(cur, uids):
+        """
+        Get article metadata for a list of article ids.
+
+        Articles are selected in batches, with one query per batch.
+
+        Args:
+            cur: database cursor
+            uids: list of article ids
+
+        Returns:
+            {article id: Article}
+        """
+        uids = list(uids)
+
+        articles = {}
+        for x in range(0, len(uids), Query.BATCH_SIZE):
+            batch = uids[x : x + Query.BATCH_SIZE]
+            cur.execute(
+                "SELECT Id, Title, Published, Publication, Design, Size, Sample, "
+                "Method, Entry, Reference FROM articles WHERE id IN (%s)"
+                % ",".join(["?"] * len(batch)),
+                batch,
+            )
+
+            for row in cur.fetchall():
+                articles[row[0]] = Article(*row)
+
+        return articles
+
+    @staticmethod
+    def results(embeddings, cur, query, topn, threshold, path=None):
+        """
+        Execute a search, group results by article and get article metadata.
+
+        Results are cached in the shared query cache when a model path is set. Cached
+        results are keyed on the index version recorded when embeddings were loaded
+        through the registry.
+
+        Args:
+            embeddings: embeddings model
+            cur: database cursor
+            query: query text
+            topn: number of documents to return
+            threshold: require at least this score to include result
+            path: model path, disables caching if None
+
+        Returns:
+            (search results, results grouped by article, {article id: Article})
+        """
+
+        def compute():
+            results = Query.search(embeddings, cur, query, topn, threshold)
+            documents = Query.documents(results, topn)
+            return (results, documents, Query.articles(cur, documents))
+
+        if not path:
+            return compute()
+
+        return CACHE.get(
+            path, REGISTRY.version(embeddings), query, topn, threshold, compute
+        )
+
+    @staticmethod
+    def batchresults(embeddings, cur, queries, topn, threshold):
+        """
+        Execute a batch search, group results by article and get article metadata.
+
+        Article metadata for all queries is selected with shared lookups. Results
+        are not cached.
+
+        Args:
+            embeddings: embeddings model
+            cur: database cursor
+            queries: list of query text
+            topn: number of documents to return per query
+            threshold: require at least this score to include result
+
+        Returns:
+            list of (search results, results grouped by article,
+            {article id: Article}) per query
+        """
+        results = Query.batchsearch(embeddings, cur, queries, topn, threshold)
+        documents = [Query.documents(result, topn) for result in results]
+
+        # Get article metadata for all queries
+        articles = Query.articles(cur, {uid for docs in documents for uid in docs})
+
+        return [
+            (result, docs, {uid: articles[uid] for uid in docs if uid in articles})
+            for result, docs in zip(results, documents)
+        ]
+
+    @staticmethod
+    def highlights(results, topn, minhash=None, mmr=None):
         """
         Build a list of highlights for the search results.
 
-        Returns top ranked sections by importance over the result list.
+        Returns top ranked sections by importance over the result list. When mmr is
+        set, sections are instead selected with maximal marginal relevance.
 
         Args:
             results: search results
             topn: number of highlights to extract
+            minhash: optional MinHash instance for approximate highlights
+            mmr: optional MMR instance for embeddings-based highlights
 
         Returns:
             top ranked sections
         """
-        sections = {}
+        sections, scores = {}, {}
         for uid, score, _, text in results:
             # Filter out lower scored results
             if score >= 0.35:
                 sections[text] = (uid, text)
+                scores.setdefault(text, score)
 
         # Return up to 5 highlights
-        return Highlights.build(sections.values(), min(topn, 5))
+        if mmr:
+            return mmr(
+                [(uid, scores[text], text) for uid, text in sections.values()],
+                min(topn, 5),
+            )
+
+        return Highlights.build(sections.values(), min(topn, 5), minhash)
 
     @staticmethod
     def documents(results, topn):
@@ -228,6 +646,32 @@ class Query:
         cur.execute("SELECT Id FROM articles")
         return {row[0]: None for row in cur.fetchall()}
 
+    @staticmethod
+    def stream(cur, size):
+        """
+        Stream all article ids by published date desc, in batches.
+
+        Dates are compared as formatted by Query.date, articles with the same date
+        are ordered by id. Articles without a published date come last.
+
+        Args:
+            cur: database cursor, not shared with other queries while streaming
+            size: batch size
+
+        Returns:
+            generator of lists of article ids
+        """
+        cur.execute(
+            "SELECT Id FROM articles ORDER BY "
+            "CASE WHEN strftime('%m-%d', Published) = '01-01' "
+            "THEN strftime('%Y', Published) ELSE date(Published) END DESC, Id"
+        )
+
+        rows = cur.fetchmany(size)
+        while rows:
+            yield [row[0] for row in rows]
+            rows = cur.fetchmany(size)
+
     @staticmethod
     def authors(authors):
         """
@@ -337,7 +781,7 @@ class Query:
         return "[%s] %s" % (size, Query.text(text)) if size else Query.text(text)
 
     @staticmethod
-    def query(embeddings, db, query, topn, threshold):
+    def query(embeddings, db, query, topn, threshold, path=None):
         """
         Execute a query against the embeddings model.
 
@@ -347,6 +791,7 @@ class Query:
             query: query string
             topn: number of query results
             threshold: query match score threshold
+            path: model path used to cache results, disables caching if None
         """
         # Default to 10 results if not specified
         topn = topn if topn else 10
@@ -355,8 +800,10 @@ class Query:
 
         print(Query.render("#Query: %s" % query, theme="729.8953") + "\n")
 
-        # Query for best matches
-        results = Query.search(embeddings, cur, query, topn, threshold)
+        # Query for best matches, grouped by document
+        results, documents, articles = Query.results(
+            embeddings, cur, query, topn, threshold, path
+        )
 
         # Extract top sections as highlights
         print(Query.render("# Highlights"))
@@ -365,31 +812,23 @@ class Query:
 
         print()
 
-        # Get results grouped by document
-        documents = Query.documents(results, topn)
-
         print(Query.render("# Articles") + "\n")
 
         # Print each result, sorted by max score descending
         for uid in sorted(
             documents, key=lambda k: sum([x[0] for x in documents[k]]), reverse=True
         ):
-            cur.execute(
-                "SELECT Title, Published, Publication, Design, Size, "
-                "Sample, Method, Entry, Id, Reference FROM articles WHERE id = ?",
-                [uid],
-            )
-            article = cur.fetchone()
-
-            print("Title: %s" % article[0])
-            print("Published: %s" % Query.date(article[1]))
-            print("Publication: %s" % article[2])
-            print("Design: %s" % Query.design(article[3]))
-            print("Sample: %s" % Query.sample(article[4], article[5]))
-            print("Method: %s" % Query.text(article[6]))
-            print("Entry: %s" % article[7])
-            print("Id: %s" % article[8])
-            print("Reference: %s" % article[9])
+            article = articles[uid]
+
+            print("Title: %s" % article.title)
+            print("Published: %s" % Query.date(article.published))
+            print("Publication: %s" % article.publication)
+            print("Design: %s" % Query.design(article.design))
+            print("Sample: %s" % Query.sample(article.size, article.sample))
+            print("Method: %s" % Query.text(article.method))
+            print("Entry: %s" % article.entry)
+            print("Id: %s" % article.id)
+            print("Reference: %s" % article.reference)
 
             # Print top matches
             for score, text in documents[uid]:
@@ -413,13 +852,13 @@ class Query:
             threshold: query match score threshold
         """
         # Load model
-        embeddings, db = Models.load(path)
+        embeddings, db = REGISTRY.load(path)
 
         # Query the database
-        Query.query(embeddings, db, query, topn, threshold)
+        Query.query(embeddings, db, query, topn, threshold, path)
 
         # Free resources
-        Models.close(db)
+        REGISTRY.close(embeddings, db)
 
 
 if __name__ == "__main__":
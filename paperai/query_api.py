@@ -2,19 +2,36 @@
 FastAPI entrypoint.
 """
 
+import asyncio
 import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
+from json import dumps
 from pathlib import Path
 from sqlite3 import Connection
-from typing import Optional
+from typing import List, Optional
 
-from fastapi import FastAPI
-from txtai.embeddings import Embeddings
+from fastapi import FastAPI, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
 
 from paperai import cli, models
+from paperai.pool import Pool
+from paperai.registry import REGISTRY
 
 app = FastAPI()
 
+# Maximum number of queries searched at once
+CONCURRENCY = int(os.environ.get("PAPERAI_CONCURRENCY", 4))
+
+# Maximum number of queries waiting for a search slot, further queries are
+# rejected
+QUEUE_SIZE = int(os.environ.get("PAPERAI_QUEUE_SIZE", 64))
+
+# Number of queries searched together by batch queries
+BATCH_SIZE = int(os.environ.get("PAPERAI_BATCH_SIZE", 64))
+
 
 @dataclass
 class LoadedModel:
@@ -24,12 +41,126 @@ class LoadedModel:
     """
 
     db: Optional[Connection] = None
-    embeddings: Optional[Embeddings] = None
+    embeddings: Optional[cli.EmbeddingsIndex] = None
+    model_path: Optional[Path] = None
+    pool: Optional[Pool] = None
+    executor: Optional[ThreadPoolExecutor] = None
+    semaphore: Optional[asyncio.Semaphore] = None
+    loader: Optional[ThreadPoolExecutor] = None
+    loading: Optional[asyncio.Future] = None
+    pending: int = 0
+
+    @property
+    def ready(self) -> bool:
+        """
+        Check if the model is loaded, search is warmed up and queries can be served.
+        """
+        return self.embeddings is not None
 
 
 LOADED_MODEL = LoadedModel()
 
 
+class PendingSlot:
+
+    """
+    Pending query slot. Taken when created and released at most once.
+    """
+
+    def __init__(self):
+        LOADED_MODEL.pending += 1
+        self.held = True
+
+    def release(self):
+        """
+        Release the slot, if still held.
+        """
+        if self.held:
+            self.held = False
+            LOADED_MODEL.pending -= 1
+
+
+@dataclass
+class BatchQuery:
+
+    """
+    Batch query request body.
+    """
+
+    queries: List[str]
+    n: int = 10
+    threshold: Optional[float] = None
+
+
+def load():
+    """
+    Load model and warm up search. Called from the loader thread.
+    """
+    try:
+        model_path = Path(models.Models.modelPath())
+
+        # Index pages are shared between API workers
+        embeddings, db = cli.load_model(model_path=model_path, mmap=True)
+
+        # Run a search to initialize lazily loaded resources
+        embeddings.search("warmup", 1)
+
+        LOADED_MODEL.db = db
+        LOADED_MODEL.model_path = model_path
+        LOADED_MODEL.pool = Pool(model_path / models.ARTICLES_SQLITE_NAME, CONCURRENCY)
+
+        # Set last, the model is ready once embeddings are set
+        LOADED_MODEL.embeddings = embeddings
+    except Exception:
+        logging.error("Failed to load model.", exc_info=True)
+
+
+def release():
+    """
+    Free model resources. Called from the loader thread.
+    """
+    if LOADED_MODEL.ready:
+        LOADED_MODEL.pool.close()
+        REGISTRY.close(LOADED_MODEL.embeddings, LOADED_MODEL.db)
+
+    LOADED_MODEL.embeddings, LOADED_MODEL.db = None, None
+
+
+@app.on_event("startup")
+async def startup():
+    """
+    Start loading the model in the background. Requests are accepted while the
+    model loads, /ready reports when queries can be served.
+    """
+    LOADED_MODEL.executor = ThreadPoolExecutor(CONCURRENCY)
+    LOADED_MODEL.semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    # The model database connection can only be used by the thread that opened it,
+    # so the model is loaded and released on the same thread
+    LOADED_MODEL.loader = ThreadPoolExecutor(1)
+    LOADED_MODEL.loading = asyncio.get_running_loop().run_in_executor(
+        LOADED_MODEL.loader, load
+    )
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    """
+    Free model resources.
+    """
+    # Wait for a model that is still loading
+    if LOADED_MODEL.loading:
+        await LOADED_MODEL.loading
+        LOADED_MODEL.loading = None
+
+    if LOADED_MODEL.executor:
+        LOADED_MODEL.executor.shutdown()
+
+    if LOADED_MODEL.loader:
+        await asyncio.get_running_loop().run_in_executor(LOADED_MODEL.loader, release)
+        LOADED_MODEL.loader.shutdown()
+
+
 @app.get("/")
 async def root():
     """
@@ -38,28 +169,125 @@ async def root():
     return {"Text": "Welcome to paperai API."}
 
 
+@app.get("/ready")
+async def ready(response: Response):
+    """
+    Readiness get entrypoint.
+    """
+    if not LOADED_MODEL.ready:
+        response.status_code = 503
+
+    return {"Ready": LOADED_MODEL.ready}
+
+
+def search(query_text: str):
+    """
+    Run a query on a pooled database connection. Called from the executor.
+    """
+    with LOADED_MODEL.pool.connection() as db:
+        return cli.model_query(
+            query_text=query_text,
+            embeddings=LOADED_MODEL.embeddings,
+            db=db,
+            model_path=LOADED_MODEL.model_path,
+        )
+
+
 @app.get("/query/{query_text}")
-async def query(query_text: str):
+async def query(query_text: str, response: Response):
     """
     Query get entrypoint.
+
+    Searches run in a bounded thread pool, so the event loop keeps serving other
+    requests. Queries wait for a free slot once CONCURRENCY queries are running and
+    are rejected when QUEUE_SIZE queries are already waiting.
     """
-    if LOADED_MODEL.db is None:
-        assert LOADED_MODEL.embeddings is None
-        embeddings, db = cli.load_model(model_path=Path(models.Models.modelPath()))
-        LOADED_MODEL.embeddings = embeddings
-        LOADED_MODEL.db = db
-    else:
-        embeddings, db = LOADED_MODEL.embeddings, LOADED_MODEL.db
+    if not LOADED_MODEL.ready:
+        response.status_code = 503
+        return {"Error": "Model not loaded."}
+
+    if LOADED_MODEL.pending >= CONCURRENCY + QUEUE_SIZE:
+        response.status_code = 503
+        return {"Error": "Too many queries."}
+
+    LOADED_MODEL.pending += 1
     try:
-        assert db is not None
-        assert embeddings is not None
-        query_results = cli.model_query(
-            query_text=query_text, embeddings=embeddings, db=db
-        )
+        async with LOADED_MODEL.semaphore:
+            query_results = await asyncio.get_running_loop().run_in_executor(
+                LOADED_MODEL.executor, search, query_text
+            )
     except ValueError:
         logging.error(
             "Failed to query model.", exc_info=True, extra=dict(query_text=query_text)
         )
         return {"Error": "Failed to query model."}
+    finally:
+        LOADED_MODEL.pending -= 1
+
     query_results_json = [result.__dict__ for result in query_results]
     return query_results_json
+
+
+def batch_search(query_texts: List[str], n: int, threshold: Optional[float]):
+    """
+    Run a batch of queries on a pooled database connection. Called from the
+    executor.
+    """
+    with LOADED_MODEL.pool.connection() as db:
+        return cli.model_batch_query(
+            query_texts=query_texts,
+            embeddings=LOADED_MODEL.embeddings,
+            db=db,
+            n=n,
+            threshold=threshold,
+        )
+
+
+@app.post("/query-batch")
+async def query_batch(batch: BatchQuery):
+    """
+    Batch query post entrypoint.
+
+    Queries are searched in batches of BATCH_SIZE, each batch takes one search
+    slot. Results are streamed as NDJSON, one line per query in input order.
+    """
+    if not LOADED_MODEL.ready:
+        return JSONResponse({"Error": "Model not loaded."}, status_code=503)
+
+    if LOADED_MODEL.pending >= CONCURRENCY + QUEUE_SIZE:
+        return JSONResponse({"Error": "Too many queries."}, status_code=503)
+
+    # Count the batch as pending before the response is returned, concurrent requests
+    # see it in the queue check
+    slot = PendingSlot()
+
+    async def stream():
+        try:
+            for x in range(0, len(batch.queries), BATCH_SIZE):
+                query_texts = batch.queries[x : x + BATCH_SIZE]
+
+                async with LOADED_MODEL.semaphore:
+                    results = await asyncio.get_running_loop().run_in_executor(
+                        LOADED_MODEL.executor,
+                        batch_search,
+                        query_texts,
+                        batch.n,
+                        batch.threshold,
+                    )
+
+                for query_text, query_results in zip(query_texts, results):
+                    query_results_json = [result.__dict__ for result in query_results]
+                    yield (
+                        dumps({"query": query_text, "results": query_results_json})
+                        + "\n"
+                    )
+        finally:
+            slot.release()
+
+    # The stream never runs if the client disconnects before the body is sent, the
+    # background task releases the slot once the response completes either way
+    return StreamingResponse(
+        stream(),
+        media_type="application/x-ndjson",
+        background=BackgroundTask(slot.release),
+    )
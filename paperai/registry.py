@@ -0,0 +1,187 @@
+"""
+Registry module
+"""
+
+import logging
+import os
+import threading
+
+from .cache import QueryCache
+from .models import ARTICLES_SQLITE_NAME, Models
+from .shards import Shards
+
+
+class Registry:
+    """
+    Process-wide registry of loaded embeddings indexes.
+
+    Each model path is loaded once and shared by all callers. Entries are reference
+    counted and stay loaded while the process runs, so later callers don't pay the
+    load time again. When the index files at a model path change, the next caller
+    gets a newly loaded index. Callers still holding the previous index keep using it
+    until they release it.
+    """
+
+    def __init__(self):
+        """
+        Create a new registry.
+        """
+        # model path -> current entry
+        self.models = {}
+
+        # id(embeddings) -> entry, for all entries with references or a model path
+        self.entries = {}
+
+        self.lock = threading.Lock()
+
+    def load(self, path=None, mmap=False):
+        """
+        Load an embeddings index and open a database connection for a model path.
+        Each call must be followed by a call to close.
+
+        Args:
+            path: model path, if None uses default path
+            mmap: memory map the ANN index read-only, see Models.mmap
+
+        Returns:
+            (embeddings, db handle)
+        """
+        # Default path if not provided
+        path = os.path.abspath(str(path if path else Models.modelPath()))
+
+        if not os.path.isdir(path):
+            raise FileExistsError(
+                f"Expected path to be a directory with {ARTICLES_SQLITE_NAME} file."
+            )
+
+        version = QueryCache.version(path)
+
+        with self.lock:
+            entry = self.models.get(path)
+            if entry and (entry["version"], entry["mmap"]) == (version, mmap):
+                entry["refs"] += 1
+            else:
+                entry = None
+
+        if not entry:
+            # Load outside of the lock, other model paths can still be acquired
+            embeddings = Models.embeddings(path, mmap)
+
+            with self.lock:
+                entry = self.models.get(path)
+
+                # Another caller loaded the same version first
+                if not entry or (entry["version"], entry["mmap"]) != (version, mmap):
+                    entry = {
+                        "path": path,
+                        "embeddings": embeddings,
+                        "version": version,
+                        "mmap": mmap,
+                        "refs": 0,
+                    }
+
+                    if embeddings is not None:
+                        self.swap(path, entry)
+
+                entry["refs"] += 1
+
+        # Connect to database file
+        db = Models.connect(os.path.join(path, ARTICLES_SQLITE_NAME))
+
+        return (entry["embeddings"], db)
+
+    def swap(self, path, entry):
+        """
+        Make entry the current entry for a model path. Caller must hold the lock.
+
+        Args:
+            path: model path
+            entry: new entry
+        """
+        previous = self.models.get(path)
+        if previous:
+            logging.info("Reloaded model from %s" % path)
+
+            # Drop previous index unless it's still in use
+            if not previous["refs"]:
+                del self.entries[id(previous["embeddings"])]
+                Registry.free(previous["embeddings"])
+
+        self.models[path] = entry
+        self.entries[id(entry["embeddings"])] = entry
+
+    def close(self, embeddings, db):
+        """
+        Release an embeddings index and close a database connection returned by load.
+
+        Args:
+            embeddings: embeddings index
+            db: database connection
+        """
+        with self.lock:
+            entry = self.entries.get(id(embeddings))
+            if entry:
+                entry["refs"] -= 1
+
+                # Drop replaced indexes once released
+                if not entry["refs"] and self.models.get(entry["path"]) is not entry:
+                    del self.entries[id(embeddings)]
+                    Registry.free(embeddings)
+
+        Models.close(db)
+
+    @staticmethod
+    def free(embeddings):
+        """
+        Free resources held by an embeddings index that is no longer used.
+
+        Args:
+            embeddings: embeddings index
+        """
+        # Sharded indexes search in a thread pool
+        if isinstance(embeddings, Shards):
+            embeddings.close()
+
+    def version(self, embeddings):
+        """
+        Get the index version recorded when an embeddings index was loaded. Results
+        computed with an index are cached under this version, not the version
+        currently on disk.
+
+        Args:
+            embeddings: embeddings index returned by load
+
+        Returns:
+            index version, None if embeddings weren't loaded through the registry
+        """
+        with self.lock:
+            entry = self.entries.get(id(embeddings))
+            return entry["version"] if entry else None
+
+    def references(self, path=None):
+        """
+        Get the number of references to the current index for a model path.
+
+        Args:
+            path: model path, if None uses default path
+
+        Returns:
+            number of references, 0 if not loaded
+        """
+        path = os.path.abspath(str(path if path else Models.modelPath()))
+
+        with self.lock:
+            entry = self.models.get(path)
+            return entry["refs"] if entry else 0
+
+    def clear(self):
+        """
+        Remove all loaded indexes. Indexes still in use are not closed.
+        """
+        with self.lock:
+            self.models.clear()
+            self.entries.clear()
+
+
+# Shared model registry for all entry points
+REGISTRY = Registry()
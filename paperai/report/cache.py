@@ -0,0 +1,102 @@
+"""
+Extraction cache module
+"""
+
+import hashlib
+import json
+import sqlite3
+
+
+class ExtractionCache:
+    """
+    On-disk cache of extracted QA answers, shared across report runs.
+
+    Entries are keyed on article id, question, question context, snippet flag, QA
+    model settings and index version. The context is built from the column query,
+    so changing a column query, question or model only re-runs the affected
+    columns. Entries for other index versions are removed when the cache is
+    opened.
+    """
+
+    def __init__(self, path, model, version):
+        """
+        Open or create an extraction cache.
+
+        Args:
+            path: cache database file
+            model: QA model settings, any JSON serializable value
+            version: index version
+        """
+        self.model = model
+        self.version = str(version)
+
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS answers "
+            + "(Key TEXT PRIMARY KEY, Version TEXT, Answer TEXT)"
+        )
+
+        # Remove answers from previous index versions
+        self.db.execute("DELETE FROM answers WHERE Version != ?", [self.version])
+        self.db.commit()
+
+    def key(self, uid, question, context, snippet):
+        """
+        Build a cache key for a question-context pair.
+
+        Args:
+            uid: article id
+            question: QA question
+            context: question context
+            snippet: if a snippet is extracted instead of the answer
+
+        Returns:
+            cache key
+        """
+        data = json.dumps(
+            [self.model, self.version, uid, question, context, bool(snippet)]
+        )
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def get(self, keys):
+        """
+        Get cached answers.
+
+        Args:
+            keys: list of cache keys
+
+        Returns:
+            {key: answer} for keys found in the cache
+        """
+        answers = {}
+
+        # Query in chunks to stay under the SQLite variable limit
+        for x in range(0, len(keys), 500):
+            chunk = keys[x : x + 500]
+            rows = self.db.execute(
+                "SELECT Key, Answer FROM answers WHERE Key IN (%s)"
+                % ",".join(["?"] * len(chunk)),
+                chunk,
+            )
+            answers.update(rows.fetchall())
+
+        return answers
+
+    def put(self, answers):
+        """
+        Store answers.
+
+        Args:
+            answers: {key: answer}
+        """
+        self.db.executemany(
+            "INSERT OR REPLACE INTO answers VALUES (?, ?, ?)",
+            [(key, self.version, answer) for key, answer in answers.items()],
+        )
+        self.db.commit()
+
+    def close(self):
+        """
+        Close the cache database.
+        """
+        self.db.close()
@@ -2,11 +2,17 @@
 Report module
 """
 
+import os
+
 import regex as re
 from txtai.pipeline import Extractor, Similarity
 
+from ..cache import QueryCache
+from ..highlights import MMR, MinHash
 from ..index import Index
 from ..query import Query
+from ..registry import REGISTRY
+from .cache import ExtractionCache
 
 
 class Report:
@@ -14,6 +20,12 @@ class Report:
     Methods to build reports from a series of queries
     """
 
+    # Number of documents processed together
+    BLOCK_SIZE = 256
+
+    # Default number of question-context pairs per QA model call
+    BATCH_SIZE = 64
+
     def __init__(self, embeddings, db, options):
         """
         Create a new report.
@@ -27,9 +39,43 @@ class Report:
         self.embeddings = embeddings
         self.cur = db.cursor()
 
+        # Database file, used to locate the extraction cache. Empty for in-memory
+        # databases.
+        self.dbfile = Report.dbfile(self.cur)
+
         # Report options
         self.options = options
 
+        # Precomputed section filter flag
+        self.indexable = Index.indexable(self.cur)
+
+        # Optional MinHash LSH highlights, set to true or a mapping of MinHash
+        # parameters (permutations, bands, floor, seed)
+        minhash = options.get("minhash")
+        self.minhash = (
+            MinHash(**(minhash if isinstance(minhash, dict) else {}))
+            if minhash
+            else None
+        )
+
+        # Optional MMR highlights, set to true or a mapping of MMR parameters
+        # (diversity)
+        mmr = options.get("mmr")
+        self.mmr = (
+            MMR(self.embeddings, **(mmr if isinstance(mmr, dict) else {}))
+            if mmr
+            else None
+        )
+
+        # Optional persistent extraction cache, set to true to store answers next to
+        # the database or a cache file path
+        self.cache = Report.extraction(
+            options, self.dbfile, REGISTRY.version(self.embeddings)
+        )
+
+        # Prefetched sections by article id
+        self.documents = {}
+
         # Column names
         self.names = []
 
@@ -101,10 +147,15 @@ class Report:
             results: search results
             topn: number of results to return
         """
+        # Article id by section text, first match is used
+        articles = {}
+        for _, _, article, text in results:
+            articles.setdefault(text, article)
+
         # Extract top sections as highlights
-        for highlight in Query.highlights(results, topn):
+        for highlight in Query.highlights(results, topn, self.minhash, self.mmr):
             # Get matching article
-            uid = [article for _, _, article, text in results if text == highlight][0]
+            uid = articles[highlight]
             self.cur.execute(
                 "SELECT Authors, Reference FROM articles WHERE id = ?", [uid]
             )
@@ -113,10 +164,62 @@ class Report:
             # Write out highlight row
             self.highlight(output, article, highlight)
 
+    @staticmethod
+    def dbfile(cur):
+        """
+        Get the file path of the main database.
+
+        Args:
+            cur: database cursor
+
+        Returns:
+            database file path, empty for in-memory databases
+        """
+        cur.execute("PRAGMA database_list")
+        return [path for _, name, path in cur.fetchall() if name == "main"][0]
+
+    @staticmethod
+    def extraction(options, dbfile, version):
+        """
+        Open the extraction cache when enabled with the cache option.
+
+        Args:
+            options: report options
+            dbfile: database file path
+            version: version of the index used to run report queries, read from
+                     the model path if None
+
+        Returns:
+            ExtractionCache or None if disabled
+        """
+        cache = options.get("cache")
+        if not cache or not dbfile:
+            return None
+
+        # Model path, used to derive the index version for indexes loaded outside of
+        # the registry
+        path = os.path.dirname(dbfile)
+        version = version if version is not None else QueryCache.version(path)
+
+        return ExtractionCache(
+            os.path.join(path, "extraction.sqlite") if cache is True else cache,
+            [
+                options.get("qa"),
+                options.get("similarity"),
+                options.get("minscore"),
+                options.get("mintokens"),
+            ],
+            version,
+        )
+
     def articles(self, output, topn, metadata, results):
         """
         Build an articles section.
 
+        Documents are processed in blocks. Question-answer columns for all
+        documents in a block are run through the extractor together in batches of
+        the batchsize option.
+
         Args:
             output: output file
             topn: number of documents to return
@@ -126,38 +229,103 @@ class Report:
         # Unpack metadata
         _, query, _ = metadata
 
-        # Retrieve list of documents
-        documents = (
-            Query.all(self.cur) if query == "*" else Query.documents(results, topn)
-        )
+        # Stream all documents for "*" queries. Documents are read in date order and
+        # rows are written as each block completes.
+        stream = query == "*"
+
+        if stream:
+            blocks = Query.stream(self.cur.connection.cursor(), Report.BLOCK_SIZE)
+        else:
+            documents = Query.documents(results, topn)
+            uids = list(documents)
+            blocks = (
+                uids[x : x + Report.BLOCK_SIZE]
+                for x in range(0, len(uids), Report.BLOCK_SIZE)
+            )
 
-        # Collect matching rows
+        # Collect matching rows, in document order
         rows = []
 
-        for uid in documents:
-            # Get article metadata
-            self.cur.execute(
-                "SELECT Published, Title, Reference, Publication, "
-                "Source, Design, Size, Sample, Method, Entry "
-                + "FROM articles WHERE id = ?",
-                [uid],
-            )
-            article = self.cur.fetchone()
+        for uids in blocks:
+            if stream:
+                self.writeRows(output, self.rows(uids, dict.fromkeys(uids), metadata))
+            else:
+                rows.extend(self.rows(uids, documents, metadata))
 
-            # Calculate derived fields
-            calculated = self.calculate(uid, metadata)
+        # Print report by published desc
+        self.writeRows(output, sorted(rows, key=lambda x: x["Date"], reverse=True))
 
-            # Builds a row for article
-            rows.append(self.buildRow(article, documents[uid], calculated))
+    def writeRows(self, output, rows):
+        """
+        Write a list of rows.
 
-        # Print report by published desc
-        for row in sorted(rows, key=lambda x: x["Date"], reverse=True):
+        Args:
+            output: output file
+            rows: list of row dicts
+        """
+        for row in rows:
             # Convert row dict to list
             row = [row[column] for column in self.names]
 
             # Write out row
             self.writeRow(output, row)
 
+    def rows(self, uids, documents, metadata):
+        """
+        Build rows for a block of documents.
+
+        Args:
+            uids: article ids
+            documents: text sections by article id
+            metadata: query metadata
+
+        Returns:
+            list of rows
+        """
+
+        # Load sections for all documents in the block
+        self.prefetch(uids)
+
+        # Get article metadata and question-context pairs for each document
+        prepared = [(self.article(uid), self.prepare(uid, metadata)) for uid in uids]
+
+        # Answer questions for all documents
+        answers = self.answers(
+            [uid for uid, (_, values) in zip(uids, prepared) for _ in values[3]],
+            [pair for _, (_, _, _, queue) in prepared for pair in queue],
+        )
+
+        # Split answers by document
+        inputs, offset = [], 0
+        for uid, (article, values) in zip(uids, prepared):
+            size = len(values[3])
+            inputs.append((uid, article, values, answers[offset : offset + size]))
+            offset += size
+
+        # Resolve answers and build rows
+        return [
+            self.buildRow(article, documents[uid], self.complete(uid, values, results))
+            for uid, article, values, results in inputs
+        ]
+
+    def article(self, uid):
+        """
+        Get article metadata.
+
+        Args:
+            uid: article id
+
+        Returns:
+            article metadata row
+        """
+        self.cur.execute(
+            "SELECT Published, Title, Reference, Publication, "
+            "Source, Design, Size, Sample, Method, Entry "
+            + "FROM articles WHERE id = ?",
+            [uid],
+        )
+        return self.cur.fetchone()
+
     def calculate(self, uid, metadata):
         """
         Build a dict of calculated fields for a given document.
@@ -174,6 +342,24 @@ class Report:
         Returns:
             {name: value} containing derived column values
         """
+        values = self.prepare(uid, metadata)
+        return self.complete(
+            uid, values, self.answers([uid] * len(values[3]), values[3])
+        )
+
+    def prepare(self, uid, metadata):
+        """
+        Calculate constant and embeddings match columns and build question-context
+        pairs for QA columns of a given document.
+
+        Args:
+            uid: article id
+            metadata: query metadata
+
+        Returns:
+            (fields, params, sections, queue) where queue is a list of
+            (name, question, context, topn, snippet) question-context pairs
+        """
         # Parse column parameters
         fields, params = self.params(metadata)
 
@@ -190,8 +376,12 @@ class Report:
             else:
                 questions.append((name, query, question, snippet))
 
-        # Run all extractor queries against document text
-        results = self.extractor.query([query for _, query, _ in queries], texts)
+        # Run all extractor queries against document text in a single call
+        results = self.extractor.query(
+            [query for _, query, _ in queries]
+            + [query for _, query, _, _ in questions],
+            texts,
+        )
 
         # Only execute embeddings queries for columns with matches set
         for x, (name, query, matches) in enumerate(queries):
@@ -206,8 +396,89 @@ class Report:
             else:
                 fields[name] = None
 
+        # Build question-context pairs, same as Extractor
+        queue = []
+        for x, (name, _, question, snippet) in enumerate(questions):
+            # Build context using top n best matching segments
+            topn = sorted(results[len(queries) + x], key=lambda y: y[2], reverse=True)
+            topn = topn[:3]
+            context = " ".join(
+                [text for _, text, _ in sorted(topn, key=lambda y: y[0])]
+            )
+
+            queue.append(
+                (name, question, context, [text for _, text, _ in topn], snippet)
+            )
+
+        return fields, params, sections, queue
+
+    def answers(self, uids, queue):
+        """
+        Run question-context pairs through the extractor QA model in batches.
+        Answers found in the extraction cache are not run again.
+
+        Args:
+            uids: article id for each question-context pair
+            queue: list of (name, question, context, topn, snippet)
+
+        Returns:
+            list of answers
+        """
+        size = self.options.get("batchsize", Report.BATCH_SIZE)
+
+        # Look up cached answers
+        keys, cached = [], {}
+        if self.cache:
+            keys = [
+                self.cache.key(uid, question, context, snippet)
+                for uid, (_, question, context, _, snippet) in zip(uids, queue)
+            ]
+            cached = self.cache.get(keys)
+
+        # Question-context pairs to run
+        pending = [x for x in range(len(queue)) if not keys or keys[x] not in cached]
+
+        answers = {}
+        for x in range(0, len(pending), size):
+            batch = pending[x : x + size]
+            names, questions, contexts, topns, snippets = zip(
+                *[queue[y] for y in batch]
+            )
+
+            results = self.extractor.answers(
+                list(names),
+                list(questions),
+                list(contexts),
+                list(topns),
+                list(snippets),
+            )
+
+            answers.update(zip(batch, [value for _, value in results]))
+
+        # Store new answers
+        if self.cache and answers:
+            self.cache.put({keys[x]: value for x, value in answers.items()})
+
+        return [
+            answers[x] if x in answers else cached[keys[x]] for x in range(len(queue))
+        ]
+
+    def complete(self, uid, values, answers):
+        """
+        Add answers to the calculated fields of a given document.
+
+        Args:
+            uid: article id
+            values: output of prepare
+            answers: answers for each question-context pair
+
+        Returns:
+            {name: value} containing derived column values
+        """
+        fields, params, sections, queue = values
+
         # Add extraction fields
-        for name, value in self.extractor(questions, texts):
+        for (name, _, _, _, _), value in zip(queue, answers):
             # Resolves the full value based on column parameters
             fields[name] = (
                 self.resolve(params, sections, uid, name, value) if value else ""
@@ -291,6 +562,59 @@ class Report:
 
         return value
 
+    def prefetch(self, uids):
+        """
+        Bulk load sections for a list of articles. Section, subsection and surround
+        lookups for these articles are answered from memory. Replaces previously
+        loaded articles.
+
+        Args:
+            uids: article ids
+        """
+        self.documents = self.load(uids)
+
+    def load(self, uids):
+        """
+        Load all sections for a list of articles.
+
+        Args:
+            uids: article ids
+
+        Returns:
+            {article id: [(id, name, text, labels, indexable)]} ordered by id
+        """
+        documents = {uid: [] for uid in uids}
+
+        for x in range(0, len(uids), Query.BATCH_SIZE):
+            batch = uids[x : x + Query.BATCH_SIZE]
+            self.cur.execute(
+                "SELECT Article, Id, Name, Text, Labels, %s FROM sections "
+                "WHERE article IN (%s) ORDER BY article, id"
+                % (
+                    "Indexable" if self.indexable else "NULL",
+                    ",".join(["?"] * len(batch)),
+                ),
+                batch,
+            )
+
+            for row in self.cur.fetchall():
+                documents[row[0]].append(row[1:])
+
+        return documents
+
+    def document(self, uid):
+        """
+        Get all sections for article with given uid.
+
+        Args:
+            uid: article id
+
+        Returns:
+            list of (id, name, text, labels, indexable) ordered by id
+        """
+        sections = self.documents.get(uid)
+        return sections if sections is not None else self.load([uid])[uid]
+
     def sections(self, uid):
         """
         Retrieve all sections as list for article with given uid.
@@ -301,13 +625,20 @@ class Report:
         Returns:
             list of section text elements
         """
-        # Retrieve indexed document text for article
-        self.cur.execute(Index.SECTION_QUERY + " AND article = ? ORDER BY id", [uid])
+        # Use precomputed section filter, if available. Section name filter isn't
+        # applied when allsections is set.
+        filtered = self.indexable and not self.options.get("allsections")
 
         # Get list of document text sections
         sections = []
-        for sid, name, text in self.cur.fetchall():
-            if (
+        for sid, name, text, labels, indexable in self.document(uid):
+            if filtered:
+                # Sections added after the last Index.prepare run aren't evaluated yet
+                if indexable == 1 or (
+                    indexable is None and Index.filtered(name, labels)
+                ):
+                    sections.append((sid, text))
+            elif labels not in ("FRAGMENT", "QUESTION") and (
                 not name
                 or not re.search(Index.SECTION_FILTER, name.lower())
                 or self.options.get("allsections")
@@ -364,12 +695,7 @@ class Report:
         Returns:
             full text for matching section
         """
-        self.cur.execute(
-            "SELECT Text FROM sections WHERE article = ? "
-            "AND name = (SELECT name FROM sections WHERE id = ?)",
-            [uid, sid],
-        )
-        return " ".join([x[0] for x in self.cur.fetchall()])
+        return self.span(uid, sid, None)
 
     def surround(self, uid, sid, size):
         """
@@ -383,14 +709,37 @@ class Report:
         Returns:
             matching text with surrounding context
         """
-        self.cur.execute(
-            "SELECT Text FROM sections WHERE article = ? "
-            "AND id in (SELECT id FROM sections WHERE id >= ? AND id <= ?) AND "
-            + "name = (SELECT name FROM sections WHERE id = ?)",
-            [uid, sid - size, sid + size, sid],
-        )
+        return self.span(uid, sid, size)
 
-        return " ".join([x[0] for x in self.cur.fetchall()])
+    def span(self, uid, sid, size):
+        """
+        Join text of sections with the same section name as the section with the
+        specified id. Sections without a name don't match any sections.
+
+        Args:
+            uid: article id
+            sid: section id
+            size: number of surrounding lines to extract from each side, None for
+                  all sections
+
+        Returns:
+            joined text
+        """
+        sections = self.document(uid)
+
+        # Section name for section id
+        name = [name for x, name, _, _, _ in sections if x == sid]
+        name = name[0] if name else None
+
+        return " ".join(
+            [
+                text
+                for x, n, text, _, _ in sections
+                if name is not None
+                and n == name
+                and (size is None or sid - size <= x <= sid + size)
+            ]
+        )
 
     def cleanup(self, outfile):
         """
@@ -400,6 +749,13 @@ class Report:
             outfile: output file path
         """
 
+    def close(self):
+        """
+        Close the extraction cache.
+        """
+        if self.cache:
+            self.cache.close()
+
     def query(self, output, task, query):
         """
         Write query.
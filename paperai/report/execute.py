@@ -4,7 +4,7 @@ Report factory module
 
 import os.path
 
-from ..models import Models
+from ..registry import REGISTRY
 from .annotate import Annotate
 from .csvr import CSV
 from .markdown import Markdown
@@ -59,7 +59,7 @@ class Execute:
             threshold: query match score threshold
         """
         # Load model
-        embeddings, db = Models.load(path)
+        embeddings, db = REGISTRY.load(path)
 
         # Read task configuration
         name, options, queries, outdir = Task.load(task)
@@ -83,9 +83,10 @@ class Execute:
 
         # Free any resources
         report.cleanup(outfile)
+        report.close()
 
         # Free resources
-        Models.close(db)
+        REGISTRY.close(embeddings, db)
 
     @staticmethod
     def options(options, topn, render, path, qa, indir, threshold):
@@ -0,0 +1,213 @@
+"""
+Shards module
+"""
+
+import heapq
+import itertools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+class Shards:
+    """
+    Embeddings index partitioned into multiple shards.
+
+    Searches fan out to every shard in parallel and the top results are merged by
+    score. Implements the subset of the Embeddings interface used by paperai, so
+    it can be used wherever an Embeddings instance is expected.
+
+    All shards are loaded into the current process. Shards share one copy of the
+    vectors, scoring and LSA models (see Models.embeddings), so a sharded index uses
+    about the same memory as a single index over the same sections. Sharding splits
+    index builds and ANN searches, it doesn't lower peak memory. Serving shards
+    from separate processes or hosts requires running a paperai API per shard
+    directory and merging results in the client.
+    """
+
+    def __init__(self, shards=None):
+        """
+        Create a new sharded index.
+
+        Args:
+            shards: list of embeddings instances
+        """
+        self.shards = shards if shards else []
+
+        # Thread pool used to search shards in parallel
+        self.pool = None
+
+    @staticmethod
+    def paths(path):
+        """
+        List shard directories in shard order.
+
+        Args:
+            path: shards directory
+
+        Returns:
+            list of shard paths
+        """
+        return [
+            os.path.join(path, name)
+            for name in sorted(
+                (x for x in os.listdir(path) if x.isdigit()), key=lambda x: int(x)
+            )
+        ]
+
+    @property
+    def config(self):
+        """
+        Index configuration, shared by all shards.
+
+        Returns:
+            configuration of the first shard
+        """
+        return self.shards[0].config
+
+    def search(self, query, limit=3):
+        """
+        Find documents most similar to the input query across all shards.
+
+        Args:
+            query: query text|tokens
+            limit: maximum results
+
+        Returns:
+            list of (id, score)
+        """
+        return self.batchsearch([query], limit)[0]
+
+    def batchsearch(self, queries, limit=3):
+        """
+        Find documents most similar to the input queries across all shards.
+
+        Queries are transformed to vectors once, with the models shared by all
+        shards. Each shard searches its ANN index for its own top results, which
+        are then merged into the overall top results per query.
+
+        Args:
+            queries: queries text|tokens
+            limit: maximum results
+
+        Returns:
+            list of (id, score) per query
+        """
+        if not self.pool:
+            self.pool = ThreadPoolExecutor(len(self.shards))
+
+        # Convert queries to embedding vectors
+        embeddings = np.array(
+            self.batchtransform([(None, query, None) for query in queries])
+        )
+
+        # Scatter query vectors to all shards
+        results = list(
+            self.pool.map(
+                lambda shard: Shards.ann(shard, embeddings, limit), self.shards
+            )
+        )
+
+        # Gather and merge top results for each query
+        return [
+            heapq.nlargest(
+                limit,
+                itertools.chain.from_iterable(shard[x] for shard in results),
+                key=lambda result: result[1],
+            )
+            for x in range(len(queries))
+        ]
+
+    @staticmethod
+    def ann(shard, embeddings, limit):
+        """
+        Search the ANN index of a single shard.
+
+        Args:
+            shard: embeddings instance
+            embeddings: query vectors
+            limit: maximum results
+
+        Returns:
+            list of (id, score) per query
+        """
+        results = shard.embeddings.search(embeddings, limit)
+
+        # Map ids if id mapping available
+        lookup = shard.config.get("ids")
+        if lookup:
+            results = [[(lookup[i], score) for i, score in r] for r in results]
+
+        return results
+
+    def count(self):
+        """
+        Total number of elements across all shards.
+
+        Returns:
+            number of elements
+        """
+        return sum(shard.count() for shard in self.shards)
+
+    def transform(self, document):
+        """
+        Transform document into an embeddings vector.
+
+        All shards share the same vectors, scoring and LSA models, the first shard
+        is used.
+
+        Args:
+            document: (id, text|tokens, tags)
+
+        Returns:
+            embeddings vector
+        """
+        return self.shards[0].transform(document)
+
+    def batchtransform(self, documents):
+        """
+        Transform documents into embeddings vectors.
+
+        Args:
+            documents: list of (id, text|tokens, tags)
+
+        Returns:
+            embeddings vectors
+        """
+        return self.shards[0].batchtransform(documents)
+
+    def similarity(self, query, texts):
+        """
+        Compute the similarity between query and list of text.
+
+        Args:
+            query: query text|tokens
+            texts: list of text|tokens
+
+        Returns:
+            list of (id, score)
+        """
+        return self.shards[0].similarity(query, texts)
+
+    def batchsimilarity(self, queries, texts):
+        """
+        Compute the similarity between list of queries and list of text.
+
+        Args:
+            queries: queries text|tokens
+            texts: list of text|tokens
+
+        Returns:
+            list of (id, score) per query
+        """
+        return self.shards[0].batchsimilarity(queries, texts)
+
+    def close(self):
+        """
+        Shut down the search thread pool. A new pool is started if the index is
+        searched again.
+        """
+        if self.pool:
+            self.pool.shutdown()
+            self.pool = None
@@ -2,11 +2,11 @@
 paperai query shell module.
 """
 
-
 from cmd import Cmd
 
 from .models import Models
 from .query import Query
+from .registry import REGISTRY
 
 
 class Shell(Cmd):
@@ -32,16 +32,23 @@ class Shell(Cmd):
         Do things before loop.
         """
         # Load embeddings and questions.db
-        self.embeddings, self.db = Models.load(self.path)
+        self.embeddings, self.db = REGISTRY.load(self.path)
 
     def postloop(self):
         """
         Do things after loop.
         """
-        Models.close(self.db)
+        REGISTRY.close(self.embeddings, self.db)
 
     def default(self, line):
         """
         Do default action.
         """
-        Query.query(self.embeddings, self.db, line, None, None)
+        Query.query(
+            self.embeddings,
+            self.db,
+            line,
+            None,
+            None,
+            self.path if self.path else Models.modelPath(),
+        )
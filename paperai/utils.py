@@ -46,3 +46,22 @@ class QueryResults:
     entry: str
     id: str
     reference: str
+
+
+@dataclass
+class Article:
+
+    """
+    Article metadata dataclass.
+    """
+
+    id: str
+    title: str
+    published: str
+    publication: str
+    design: int
+    size: str
+    sample: str
+    method: str
+    entry: str
+    reference: str
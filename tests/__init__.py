@@ -9,5 +9,6 @@ def test_app_params():
     """
     return [
         ("query-model", ["--help"]),
+        ("query-batch", ["--help"]),
         ("preview-doi", ["--help"]),
     ]
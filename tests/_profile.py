@@ -2,12 +2,145 @@
 Script for profiling ``paperai`` performance.
 """
 
+import sqlite3
+import timeit
+
+from paperai.highlights import MMR, Highlights, MinHash
+from paperai.models import Models
+from paperai.query import Query
+from tests.utils import Utils
+
+
+def benchmark_sections(query="risk factors", topn=50, number=20):
+    """
+    Compare per-hit and batched section lookups used by ``Query.search``.
+
+    Uses the test database and index.
+    """
+    embeddings, db = Models.load(Utils.PATH)
+    cur = db.cursor()
+
+    uids = [uid for uid, _ in embeddings.search(query, topn * 5)]
+
+    def single():
+        sections = {}
+        for uid in uids:
+            cur.execute("SELECT Article, Text FROM sections WHERE id = ?", [uid])
+            sections[uid] = cur.fetchone()
+
+        return sections
+
+    def batch():
+        return Query.sections(cur, uids)
+
+    assert single() == batch()
+
+    for name, method in [("single", single), ("batch", batch)]:
+        elapsed = timeit.timeit(method, number=number) / number
+        print(f"{name:>8} lookup of {len(uids)} sections: {elapsed * 1000:.3f} ms")
+
+    Models.close(db)
+
+
+def benchmark_textrank(query="risk factors", topn=250, number=5):
+    """
+    Compare networkx and vectorized textrank used by ``Highlights.build``.
+
+    Uses the test database and index.
+    """
+    embeddings, db = Models.load(Utils.PATH)
+    cur = db.cursor()
+
+    results = Query.search(embeddings, cur, query, topn, 0.0)
+    sections = list({text: (uid, text) for uid, _, _, text in results}.values())
+
+    for name, method in [
+        ("networkx", Highlights.textrankGraph),
+        ("numpy", Highlights.textrank),
+    ]:
+        elapsed = timeit.timeit(lambda: method(sections), number=number) / number
+        print(
+            f"{name:>8} textrank of {len(sections)} sections: {elapsed * 1000:.3f} ms"
+        )
+
+    Models.close(db)
+
+
+def benchmark_minhash(sizes=(100, 250, 500, 1000, 2000, 4000), topn=5):
+    """
+    Compare exact and MinHash LSH highlights over increasing numbers of sections.
+
+    Prints build time and how many of the exact highlights are also found with
+    MinHash, for an accurate (32 bands of 2 rows) and a fast (16 bands of 4 rows,
+    0.3 edge floor) configuration. Uses the test database.
+    """
+    db = sqlite3.connect(Utils.DBFILE)
+    cur = db.cursor()
+
+    cur.execute(
+        "SELECT Id, Text FROM sections WHERE Text IS NOT NULL LIMIT ?", [max(sizes)]
+    )
+    rows = cur.fetchall()
+
+    methods = [
+        ("exact", None),
+        ("accurate", MinHash(permutations=64, bands=32)),
+        ("fast", MinHash(permutations=64, bands=16, floor=0.3)),
+    ]
+
+    for size in sizes:
+        sections = rows[:size]
+        reference = set(Highlights.build(sections, topn))
+
+        for name, minhash in methods:
+            start = timeit.default_timer()
+            highlights = Highlights.build(sections, topn, minhash)
+            elapsed = timeit.default_timer() - start
+
+            found = len(reference & set(highlights))
+            print(
+                f"{name:>8} highlights of {len(sections)} sections: "
+                f"{elapsed * 1000:.3f} ms, {found}/{len(reference)} exact highlights"
+            )
+
+    db.close()
+
+
+def benchmark_mmr(query="risk factors", sizes=(50, 250, 1000), number=3):
+    """
+    Compare textrank and MMR highlights over increasing candidate pools.
+
+    Uses the test database and index.
+    """
+    embeddings, db = Models.load(Utils.PATH)
+    cur = db.cursor()
+
+    for size in sizes:
+        results = Query.search(embeddings, cur, query, size, 0.0)
+
+        for name, mmr in [("textrank", None), ("mmr", MMR(embeddings))]:
+            elapsed = (
+                timeit.timeit(
+                    lambda: Query.highlights(results, 5, mmr=mmr), number=number
+                )
+                / number
+            )
+            print(
+                f"{name:>8} highlights of {len(results)} results: "
+                f"{elapsed * 1000:.3f} ms"
+            )
+
+    Models.close(db)
+
 
 def perf_profile():
     """
     Profile ``paperai`` performance.
     """
-    return
+    benchmark_sections()
+    benchmark_textrank()
+    benchmark_minhash()
+    benchmark_mmr()
 
 
 if __name__ == "__main__":
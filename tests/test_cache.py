@@ -0,0 +1,89 @@
+"""
+Cache module tests
+"""
+
+import os
+import tempfile
+import time
+import unittest
+
+# pylint: disable=E0401
+from paperai.cache import QueryCache
+
+
+class TestCache(unittest.TestCase):
+    """
+    Cache tests
+    """
+
+    def setUp(self):
+        """
+        Create a model path with an index config file.
+        """
+
+        self.path = tempfile.mkdtemp()
+        self.config = os.path.join(self.path, "config")
+
+        with open(self.config, "w") as output:
+            output.write("config")
+
+    def testGet(self):
+        """
+        Test cached results are returned for normalized queries
+        """
+
+        cache = QueryCache()
+
+        self.assertEqual(
+            cache.get(self.path, 1, "Risk  factors", 10, None, lambda: 1), 1
+        )
+        self.assertEqual(
+            cache.get(self.path, 1, "risk factors", 10, None, lambda: 2), 1
+        )
+        self.assertEqual(cache.get(self.path, 1, "risk factors", 5, None, lambda: 3), 3)
+        self.assertEqual(cache.get(self.path, 1, "risk factors", 10, 0.5, lambda: 4), 4)
+
+        self.assertEqual(cache.stats(), {"hits": 1, "misses": 3, "size": 3})
+
+    def testEvict(self):
+        """
+        Test least recently used and expired entries are evicted
+        """
+
+        cache = QueryCache(maxsize=2)
+
+        cache.get(self.path, 1, "a", 10, None, lambda: "a")
+        cache.get(self.path, 1, "b", 10, None, lambda: "b")
+        cache.get(self.path, 1, "a", 10, None, lambda: "x")
+        cache.get(self.path, 1, "c", 10, None, lambda: "c")
+
+        self.assertEqual(cache.get(self.path, 1, "a", 10, None, lambda: "x"), "a")
+        self.assertEqual(cache.get(self.path, 1, "b", 10, None, lambda: "x"), "x")
+
+        cache = QueryCache(ttl=0)
+        cache.get(self.path, 1, "a", 10, None, lambda: "a")
+        self.assertEqual(cache.get(self.path, 1, "a", 10, None, lambda: "x"), "x")
+
+    def testVersion(self):
+        """
+        Test results are cached per index version
+        """
+
+        cache = QueryCache()
+        cache.get(self.path, 1, "a", 10, None, lambda: "a")
+
+        # Index rebuilt and loaded, entries for the previous version are purged
+        self.assertEqual(cache.get(self.path, 2, "a", 10, None, lambda: "b"), "b")
+        self.assertEqual(cache.stats()["size"], 1)
+
+        # Callers still holding the previous index don't get or purge newer results
+        self.assertEqual(cache.get(self.path, 1, "a", 10, None, lambda: "c"), "c")
+        self.assertEqual(cache.get(self.path, 2, "a", 10, None, lambda: "x"), "b")
+        self.assertEqual(cache.stats()["size"], 2)
+
+        # Version is read from the index files
+        version = QueryCache.version(self.path)
+
+        mtime = time.time() + 10
+        os.utime(self.config, (mtime, mtime))
+        self.assertGreater(QueryCache.version(self.path), version)
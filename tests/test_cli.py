@@ -2,6 +2,7 @@
 Tests for cli.py.
 """
 
+import tempfile
 from traceback import print_tb
 
 import pytest
@@ -35,3 +36,23 @@ def test_app(subcommand, args):
     """
     result = runner.invoke(cli.app, [subcommand, *args])
     click_error_print(result=result)
+
+
+def test_query_batch_size():
+    """
+    Test query-batch rejects non-positive batch sizes.
+    """
+    for batch_size in ["0", "-1"]:
+        result = runner.invoke(
+            cli.app,
+            [
+                "query-batch",
+                "--model-path",
+                tempfile.mkdtemp(),
+                "--batch-size",
+                batch_size,
+            ],
+            input="risk factors\n",
+        )
+        assert result.exit_code == 2
+        assert "--batch-size" in result.output
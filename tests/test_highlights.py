@@ -0,0 +1,188 @@
+"""
+Highlights module tests
+"""
+
+import random
+import time
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+# pylint: disable=E0401
+from paperai.highlights import MMR, Highlights, MinHash
+
+
+class TestHighlights(unittest.TestCase):
+    """
+    Highlights tests
+    """
+
+    @staticmethod
+    def sections(count, seed=0):
+        """
+        Generate random sections from a small vocabulary.
+
+        Args:
+            count: number of sections
+            seed: random seed
+
+        Returns:
+            list of (uid, text)
+        """
+        generator = random.Random(seed)
+        vocab = ["term%d" % x for x in range(200)]
+
+        sections = [
+            (uid, " ".join(generator.sample(vocab, generator.randint(1, 30))))
+            for uid in range(count)
+        ]
+
+        # Sections without edges
+        sections.append((count, "short text"))
+        sections.append((count + 1, "term500 term501 term502"))
+
+        return sections
+
+    def testTextrank(self):
+        """
+        Test vectorized textrank matches networkx reference implementation
+        """
+
+        for count in [0, 1, 2, 10, 100, 500]:
+            sections = TestHighlights.sections(count, count)
+
+            rank = Highlights.textrank(sections)
+            reference = Highlights.textrankGraph(sections)
+
+            self.assertEqual(len(rank), len(reference))
+
+            # Scores match within tolerance
+            scores = dict(rank)
+            for uid, score in reference:
+                self.assertAlmostEqual(scores[uid], score, places=12)
+
+            # Rankings match, ignoring floating point differences between ties
+            def order(results):
+                return sorted(results, key=lambda x: (-round(x[1], 12), x[0]))
+
+            self.assertEqual(
+                [uid for uid, _ in order(rank)], [uid for uid, _ in order(reference)]
+            )
+
+    def testBuild(self):
+        """
+        Test highlights are built from unique sections
+        """
+
+        sections = TestHighlights.sections(100)
+        highlights = Highlights.build(sections, 5)
+
+        self.assertEqual(len(highlights), 5)
+
+        tokens = [Highlights.tokenize(text) for text in highlights]
+        for x, t1 in enumerate(tokens):
+            for t2 in tokens[x + 1 :]:
+                self.assertLessEqual(Highlights.jaccardIndex(t1, t2), 0.2)
+
+    def testMinHash(self):
+        """
+        Test MinHash LSH finds similar pairs and builds unique highlights
+        """
+
+        sections = TestHighlights.sections(100)
+
+        # Add near duplicates of the first 10 sections
+        sections += [
+            (1000 + uid, text + " term300") for uid, text in sections[:10] if text
+        ]
+
+        sets = [Highlights.tokenize(text) for _, text in sections]
+
+        minhash = MinHash()
+        pairs = {(x, y) for x, y in minhash.pairs(minhash.signatures(sets)).tolist()}
+
+        # All highly similar pairs are candidates
+        for x, t1 in enumerate(sets):
+            for y in range(x + 1, len(sets)):
+                if Highlights.jaccardIndex(t1, sets[y]) >= 0.6:
+                    self.assertIn((x, y), pairs)
+
+        highlights = Highlights.build(sections, 5, minhash)
+        self.assertEqual(len(highlights), 5)
+
+        tokens = [Highlights.tokenize(text) for text in highlights]
+        for x, t1 in enumerate(tokens):
+            for t2 in tokens[x + 1 :]:
+                self.assertLessEqual(Highlights.jaccardIndex(t1, t2), 0.2)
+
+        with self.assertRaises(ValueError):
+            MinHash(permutations=64, bands=10)
+
+    def testScaling(self):
+        """
+        Test highlight selection scales linearly with the number of sections
+        """
+
+        def textrank(sections, minhash=None, vectors=None):
+            # pylint: disable=W0613
+            return [(uid, 1.0) for uid, _ in sections]
+
+        def elapsed(sections):
+            # Best of 3 runs
+            times = []
+            for _ in range(3):
+                start = time.perf_counter()
+                Highlights.build(sections, 5)
+                times.append(time.perf_counter() - start)
+
+            return min(times)
+
+        # Rank sections in input order to isolate selection from textrank
+        with patch.object(Highlights, "textrank", textrank):
+            small = elapsed(TestHighlights.sections(2000))
+            large = elapsed(TestHighlights.sections(8000))
+
+        # 4x the sections, quadratic lookups would take ~16x as long
+        self.assertLess(large / small, 8)
+
+        # Sections are tokenized once
+        sections = TestHighlights.sections(2000)
+        with patch.object(
+            Highlights, "tokenize", wraps=Highlights.tokenize
+        ) as tokenize:
+            Highlights.build(sections, 5)
+            self.assertEqual(tokenize.call_count, len(sections))
+
+    def testMMR(self):
+        """
+        Test MMR trades relevance against diversity
+        """
+
+        class Embeddings:
+            """
+            Embeddings stub with one vector per section text.
+            """
+
+            vectors = {
+                "alpha": [1.0, 0.0],
+                "alpha copy": [1.0, 0.0],
+                "beta": [0.0, 1.0],
+            }
+
+            def batchtransform(self, documents):
+                return [
+                    np.array(Embeddings.vectors[" ".join(tokens)])
+                    for _, tokens, _ in documents
+                ]
+
+        sections = [(1, 0.9, "alpha"), (2, 0.85, "alpha copy"), (3, 0.5, "beta")]
+
+        # Relevance only
+        self.assertEqual(MMR(Embeddings(), 0.0)(sections, 2), ["alpha", "alpha copy"])
+
+        # Duplicates are penalized
+        self.assertEqual(MMR(Embeddings(), 0.5)(sections, 2), ["alpha", "beta"])
+
+        self.assertEqual(MMR(Embeddings())([], 5), [])
+        self.assertEqual(len(MMR(Embeddings())(sections, 5)), 3)
@@ -2,10 +2,19 @@
 Index module tests
 """
 
+import os
+import sqlite3
+import tempfile
 import unittest
+from unittest.mock import patch
+
+import regex as re
+from txtai.embeddings import Embeddings
 
 # pylint: disable=E0401
-from paperai.index import Index
+from paperai.index import Checkpoint, Index, Tokens
+from paperai.models import Models
+from paperai.query import Query
 from tests.utils import Utils
 
 
@@ -14,6 +23,45 @@ class TestIndex(unittest.TestCase):
     Index tests
     """
 
+    @staticmethod
+    def database():
+        """
+        Create a model path with a synthetic articles database.
+
+        Returns:
+            model path
+        """
+        path = tempfile.mkdtemp()
+
+        db = sqlite3.connect(os.path.join(path, "articles.sqlite"))
+        db.execute("CREATE TABLE articles (Id TEXT PRIMARY KEY, Entry DATETIME)")
+        db.execute(
+            "CREATE TABLE sections (Id INTEGER PRIMARY KEY, Article TEXT, "
+            "Name TEXT, Text TEXT, Tags TEXT, Labels TEXT)"
+        )
+
+        for x in range(10):
+            db.execute("INSERT INTO articles VALUES (?, ?)", ["%d" % x, x])
+
+        words = ["risk", "factors", "hypertension", "diabetes", "age", "patients"]
+        for x in range(50):
+            db.execute(
+                "INSERT INTO sections VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    x,
+                    "%d" % (x % 10),
+                    None,
+                    " ".join(words[x % 6 :] + words[: x % 4]),
+                    "tags",
+                    None,
+                ],
+            )
+
+        db.commit()
+        db.close()
+
+        return path
+
     def testStream(self):
         """
         Test row streaming
@@ -24,3 +72,259 @@ class TestIndex(unittest.TestCase):
 
         # Partial index stream - top n documents by entry date
         self.assertEqual(len(list(Index.stream(Utils.DBFILE, 10))), 224)
+
+    def testPrepare(self):
+        """
+        Test precomputed section filter matches regex filtering and indexes are created
+        """
+
+        dbfile = os.path.join(TestIndex.database(), "articles.sqlite")
+
+        # Sections covering each label and section name filter
+        db = sqlite3.connect(dbfile)
+        for x, name in enumerate(
+            [
+                "INTRODUCTION",
+                "Background",
+                "Discussion",
+                "Results and discussion",
+                "References",
+                "Methods",
+            ]
+        ):
+            db.execute("UPDATE sections SET Name = ? WHERE Id % 7 = ?", [name, x])
+
+        db.execute("UPDATE sections SET Labels = 'FRAGMENT' WHERE Id % 5 = 0")
+        db.execute("UPDATE sections SET Labels = 'QUESTION' WHERE Id % 5 = 1")
+        db.execute("UPDATE sections SET Tags = NULL WHERE Id % 11 = 0")
+        db.commit()
+
+        # Sections selected by the regex filter
+        cur = db.cursor()
+        self.assertFalse(Index.indexable(cur))
+
+        expected = [
+            uid
+            for uid, name, _ in cur.execute(Index.SECTION_QUERY)
+            if not name or not re.search(Index.SECTION_FILTER, name.lower())
+        ]
+        streams = [sorted(Index.stream(dbfile, 0)), sorted(Index.stream(dbfile, 5))]
+
+        Index.prepare(dbfile)
+
+        # Indexable column matches the regex filter, rows are read in index order
+        self.assertTrue(Index.indexable(cur))
+        self.assertEqual(
+            sorted(uid for uid, _, _ in cur.execute(Index.INDEXABLE_QUERY)), expected
+        )
+        self.assertEqual(
+            [sorted(Index.stream(dbfile, 0)), sorted(Index.stream(dbfile, 5))], streams
+        )
+
+        # Partial index and article index are created
+        self.assertEqual(
+            cur.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index' "
+                "AND name IN ('section_indexable', 'section_article') ORDER BY name"
+            ).fetchall(),
+            [("section_article",), ("section_indexable",)],
+        )
+
+        # Sections added after Index.prepare fall back to the label and name filters
+        for uid, name, labels in [
+            (50, None, None),
+            (51, "Introduction", None),
+            (52, "Methods", "FRAGMENT"),
+            (53, "Methods", None),
+        ]:
+            cur.execute(
+                "INSERT INTO sections (Id, Article, Name, Text, Tags, Labels) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [uid, "0", name, "risk factors", "tags", labels],
+            )
+        db.commit()
+
+        self.assertEqual(
+            sorted(
+                uid
+                for uid, name, _ in cur.execute(Index.INDEXABLE_QUERY)
+                if not name or Index.filtered(name, None)
+            ),
+            expected + [50, 53],
+        )
+        self.assertEqual(
+            sorted(uid for uid, _, _ in Index.stream(dbfile, 0) if uid >= 50), [50, 53]
+        )
+        self.assertEqual(
+            sorted(Query.sections(cur, list(range(48, 54)), True)),
+            [x for x in [48, 49] if x in expected] + [50, 53],
+        )
+        db.close()
+
+    def testStreamParallel(self):
+        """
+        Test parallel row streaming matches serial streaming
+        """
+
+        self.assertEqual(
+            list(Index.stream(Utils.DBFILE, 0, workers=2)),
+            list(Index.stream(Utils.DBFILE, 0)),
+        )
+
+    def testTokens(self):
+        """
+        Test token spill replays the stream across multiple iterations
+        """
+
+        tokens = Tokens(Index.stream(Utils.DBFILE, 10))
+        stream = list(Index.stream(Utils.DBFILE, 10))
+
+        self.assertEqual(len(tokens), 224)
+        self.assertEqual(list(tokens), stream)
+        self.assertEqual(list(tokens), stream)
+
+        tokens.close()
+
+        def error():
+            yield from stream[:10]
+            raise RuntimeError("Stream failed")
+
+        # Partially written spill file is removed
+        path = os.path.join(tempfile.mkdtemp(), "tokens")
+        with self.assertRaises(RuntimeError):
+            Tokens(error(), path)
+
+        self.assertFalse(os.path.exists(path))
+
+        # Empty spill is replayed instead of streaming the database again and removed
+        with patch.object(
+            Index, "stream", return_value=iter([])
+        ) as stream, patch.object(Embeddings, "score") as score, patch.object(
+            Embeddings, "index"
+        ) as index, patch.object(
+            Tokens, "close", autospec=True, side_effect=Tokens.close
+        ) as close:
+            Index.embeddings(Utils.DBFILE, Utils.VECTORFILE, 0)
+
+            self.assertEqual(stream.call_count, 1)
+            self.assertIsInstance(score.call_args[0][0], Tokens)
+            self.assertIsInstance(index.call_args[0][0], Tokens)
+
+            tokens = close.call_args[0][0]
+            self.assertEqual(len(tokens), 0)
+            self.assertFalse(os.path.exists(tokens.path))
+
+    def testIncremental(self):
+        """
+        Test incremental updates append sections for new articles
+        """
+
+        Index.run(Utils.PATH, Utils.VECTORFILE)
+        state = Index.state(Utils.PATH)
+
+        self.assertEqual(state["entry"], Index.entry(Utils.DBFILE))
+
+        # No articles after high-water mark
+        embeddings = Index.update(Utils.PATH, Utils.DBFILE, state["entry"])
+        self.assertEqual(embeddings.count(), len(embeddings.config["ids"]))
+        self.assertEqual(embeddings.count(), len(list(Index.stream(Utils.DBFILE, 0))))
+
+        path = TestIndex.database()
+        Index.run(path, Utils.VECTORFILE)
+
+        embeddings = Models.mapped(path)
+        ids = embeddings.config["ids"]
+        inode = os.stat(os.path.join(path, "embeddings")).st_ino
+
+        # Add articles with a later entry date
+        db = sqlite3.connect(os.path.join(path, "articles.sqlite"))
+        for x in range(10, 12):
+            db.execute("INSERT INTO articles VALUES (?, ?)", ["%d" % x, x])
+
+        for x in range(50, 56):
+            db.execute(
+                "INSERT INTO sections (Id, Article, Text, Tags) VALUES (?, ?, ?, ?)",
+                [x, "%d" % (10 + x % 2), "vaccine efficacy trial", "tags"],
+            )
+
+        db.commit()
+        db.close()
+
+        Index.run(path, Utils.VECTORFILE, incremental=True)
+        self.assertEqual(Index.state(path)["entry"], 11)
+
+        # Index files are replaced, previously mapped index is still readable
+        self.assertNotEqual(os.stat(os.path.join(path, "embeddings")).st_ino, inode)
+        self.assertFalse([x for x in os.listdir(path) if x.startswith(".index")])
+        self.assertIn(embeddings.search("risk factors", 1)[0][0], ids)
+
+        # New sections are appended after existing sections
+        embeddings = Embeddings()
+        embeddings.load(path)
+        self.assertEqual(embeddings.config["ids"][: len(ids)], ids)
+        self.assertEqual(
+            sorted(embeddings.config["ids"][len(ids) :]), list(range(50, 56))
+        )
+        self.assertEqual(embeddings.config["offset"], len(ids) + 6)
+        self.assertEqual(embeddings.count(), len(ids) + 6)
+
+        # New sections are searchable
+        self.assertIn(
+            embeddings.search("vaccine efficacy trial", 1)[0][0], range(50, 56)
+        )
+
+    def testResume(self):
+        """
+        Test a build killed mid-way and resumed matches a clean build
+        """
+
+        clean, crashed = TestIndex.database(), TestIndex.database()
+
+        # Vectors method, called once per checkpoint batch
+        vectors = Embeddings.vectors
+
+        def crash(embeddings, documents):
+            if crash.calls == 2:
+                raise RuntimeError("Killed build")
+
+            crash.calls += 1
+            return vectors(embeddings, documents)
+
+        crash.calls = 0
+
+        with patch.object(Index, "CHECKPOINT_SIZE", 10):
+            Index.run(clean, Utils.VECTORFILE, checkpoint=True)
+
+            with patch.object(Embeddings, "vectors", crash):
+                with self.assertRaises(RuntimeError):
+                    Index.run(crashed, Utils.VECTORFILE, checkpoint=True)
+
+            # Two batches persisted before the build was killed
+            checkpoint = Checkpoint(
+                os.path.join(crashed, "checkpoint"),
+                Index.config(Utils.VECTORFILE),
+                0,
+                True,
+            )
+            self.assertEqual(checkpoint.state["documents"], 20)
+
+            Index.run(crashed, Utils.VECTORFILE, resume=True)
+
+        # Checkpoint removed after build completes
+        self.assertFalse(os.path.exists(os.path.join(crashed, "checkpoint")))
+
+        for name in ["config", "embeddings", "lsa", "scoring"]:
+            with open(os.path.join(clean, name), "rb") as f1:
+                with open(os.path.join(crashed, name), "rb") as f2:
+                    self.assertEqual(f1.read(), f2.read())
+
+        # Empty checkpoint
+        ids, vectors = Checkpoint(
+            os.path.join(tempfile.mkdtemp(), "checkpoint"), {}, 0
+        ).read()
+        self.assertEqual((ids, vectors.shape[0]), ([], 0))
+
+        # Builds only checkpoint when requested
+        with patch.object(Checkpoint, "write") as write:
+            Index.run(clean, Utils.VECTORFILE)
+            self.assertFalse(write.called)
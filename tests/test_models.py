@@ -2,11 +2,46 @@
 Models module tests
 """
 
+import os
+import subprocess
+import sys
+import tempfile
 import unittest
 
+import faiss
+import numpy as np
+
 # pylint: disable=E0401
 from paperai.models import Models
 
+# Loads an index file in a new process and prints the increase in anonymous
+# resident memory (KB) after searching all inverted lists
+WORKER = """
+import sys
+
+import numpy as np
+from txtai.ann import Faiss
+
+from paperai.models import Models
+
+def anonymous():
+    with open("/proc/self/status") as status:
+        return [int(x.split()[1]) for x in status if x.startswith("RssAnon")][0]
+
+start = anonymous()
+
+ann = Faiss({})
+if sys.argv[2] == "mmap":
+    Models.mmap(ann, sys.argv[1])
+else:
+    ann.load(sys.argv[1])
+
+ann.model.nprobe = ann.model.nlist
+ann.model.search(np.random.rand(10, 64).astype(np.float32), 10)
+
+print(anonymous() - start)
+"""
+
 
 class TestModels(unittest.TestCase):
     """
@@ -20,6 +55,37 @@ class TestModels(unittest.TestCase):
 
         self.assertTrue(Models.basePath().endswith(".cord19"))
 
+    @unittest.skipIf(not os.path.exists("/proc/self/status"), "Requires procfs")
+    def testMmap(self):
+        """
+        Test memory mapped indexes add little resident memory per worker
+        """
+
+        # Build a synthetic 25 MB IVF index
+        path = os.path.join(tempfile.mkdtemp(), "embeddings")
+        data = np.random.rand(100000, 64).astype(np.float32)
+
+        index = faiss.index_factory(64, "IVF100,Flat", faiss.METRIC_INNER_PRODUCT)
+        index.train(data)
+        index.add_with_ids(data, np.arange(data.shape[0], dtype=np.int64))
+        faiss.write_index(index, path)
+
+        size = os.path.getsize(path) / 1024
+
+        def worker(mode):
+            return int(
+                subprocess.check_output(
+                    [sys.executable, "-c", WORKER, path, mode],
+                    cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                )
+            )
+
+        # Each worker holds a private copy of a loaded index
+        self.assertGreater(worker("load"), size * 0.75)
+
+        # Memory mapped index pages are shared
+        self.assertLess(worker("mmap"), size * 0.1)
+
     def testModelPath(self):
         """
         Test model path
@@ -0,0 +1,77 @@
+"""
+Pool module tests
+"""
+
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+
+# pylint: disable=E0401
+from paperai.models import Models
+from paperai.pool import Pool
+
+
+class TestPool(unittest.TestCase):
+    """
+    Pool tests
+    """
+
+    def setUp(self):
+        """
+        Create a database file.
+        """
+
+        self.dbfile = os.path.join(tempfile.mkdtemp(), "articles.sqlite")
+
+        db = sqlite3.connect(self.dbfile)
+        db.execute("CREATE TABLE articles (Id TEXT PRIMARY KEY)")
+        db.execute("INSERT INTO articles VALUES ('0')")
+        db.commit()
+        db.close()
+
+    def testConnect(self):
+        """
+        Test connections are read-only
+        """
+
+        db = Models.connect(self.dbfile)
+        self.assertEqual(db.execute("SELECT Id FROM articles").fetchall(), [("0",)])
+
+        with self.assertRaises(sqlite3.OperationalError):
+            db.execute("INSERT INTO articles VALUES ('1')")
+
+        db.close()
+
+        # Missing databases aren't created
+        with self.assertRaises(sqlite3.OperationalError):
+            Models.connect(self.dbfile + ".missing")
+
+    def testPool(self):
+        """
+        Test connections are shared across threads up to the pool size
+        """
+
+        pool = Pool(self.dbfile, 2)
+        connections, results = set(), []
+
+        def run():
+            with pool.connection() as db:
+                connections.add(id(db))
+                time.sleep(0.01)
+                results.append(db.execute("SELECT Id FROM articles").fetchone()[0])
+
+        threads = [threading.Thread(target=run) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, ["0"] * 8)
+        self.assertLessEqual(len(connections), 2)
+        self.assertEqual(pool.opened, len(connections))
+
+        pool.close()
+        self.assertEqual(pool.opened, 0)
@@ -3,14 +3,96 @@ Query module tests
 """
 
 import os
+import sqlite3
+import tempfile
 import unittest
 from contextlib import redirect_stdout
+from unittest.mock import patch
 
 # pylint: disable=E0401
+from paperai.index import Index
 from paperai.query import Query
 from tests.utils import Utils
 
 
+class Embeddings:
+    """
+    Embeddings stub returning sections in descending score order.
+    """
+
+    def __init__(self, size=300):
+        """
+        Create a new embeddings stub.
+
+        Args:
+            size: number of sections in the index
+        """
+        self.size = size
+
+        # (number of queries, limit) per search call
+        self.calls = []
+
+    def search(self, query, limit):
+        """
+        Search a single query.
+        """
+        return self.batchsearch([query], limit)[0]
+
+    def batchsearch(self, queries, limit):
+        """
+        Search a list of queries, every query returns the same sections.
+        """
+        self.calls.append((len(queries), limit))
+        return [
+            [(x, 1.0 - x / 1000) for x in range(min(limit, self.size))] for _ in queries
+        ]
+
+    def similarity(self, query, texts):
+        """
+        Score texts against a query, scores decrease in input order.
+        """
+        # pylint: disable=W0613
+        return [(x, 1.0 - x / 1000) for x in range(len(texts))]
+
+
+def database():
+    """
+    Create a database with three sections per article. Every other article
+    mentions "vaccine".
+
+    Returns:
+        database file
+    """
+    dbfile = os.path.join(tempfile.mkdtemp(), "articles.sqlite")
+
+    db = sqlite3.connect(dbfile)
+    db.execute(
+        "CREATE TABLE sections (Id INTEGER PRIMARY KEY, Article TEXT, Name TEXT, "
+        "Text TEXT, Tags TEXT, Labels TEXT)"
+    )
+
+    topics = ["risk factors", "smoking history", "mortality CI"]
+    db.executemany(
+        "INSERT INTO sections VALUES (?, ?, ?, ?, ?, ?)",
+        [
+            (
+                x,
+                str(x // 3),
+                None,
+                "%s %s" % ("Vaccine" if (x // 3) % 2 else "Treatment", topics[x % 3]),
+                "tags",
+                None,
+            )
+            for x in range(300)
+        ],
+    )
+
+    db.commit()
+    db.close()
+
+    return dbfile
+
+
 class TestQuery(unittest.TestCase):
     """
     Query tests
@@ -31,3 +113,143 @@ class TestQuery(unittest.TestCase):
             Utils.hashfile(Utils.PATH + "/query.txt"),
             "36ddb7968dd4988f64a300920fb0452a",
         )
+
+    def testSearchAdaptive(self):
+        """
+        Test the candidate pool grows only until enough articles match
+        """
+
+        db = sqlite3.connect(database())
+        cur = db.cursor()
+
+        # Unfiltered search uses a fixed candidate pool
+        embeddings = Embeddings()
+        results = Query.search(embeddings, cur, "risk", 5, 0.0)
+        self.assertEqual(embeddings.calls, [(1, 25)])
+        self.assertEqual(len({article for _, _, article, _ in results}), 9)
+
+        # Required tokens grow the pool until enough matching articles are found
+        embeddings = Embeddings()
+        results = Query.search(embeddings, cur, "risk +vaccine", 10, 0.0)
+        self.assertEqual(embeddings.calls, [(1, 50), (1, 100)])
+        self.assertEqual(len({article for _, _, article, _ in results}), 17)
+        self.assertTrue(all("vaccine" in text.lower() for _, _, _, text in results))
+
+        # Search stops when the index is exhausted
+        embeddings = Embeddings(12)
+        results = Query.search(embeddings, cur, "risk +vaccine", 10, 0.0)
+        self.assertEqual(embeddings.calls, [(1, 50)])
+        self.assertEqual(len(results), 6)
+
+        db.close()
+
+    def testBatchsearch(self):
+        """
+        Test batch search matches single query search and shares search rounds
+        """
+
+        db = sqlite3.connect(database())
+        cur = db.cursor()
+
+        queries = ["risk", "risk +vaccine", "risk -vaccine"]
+        expected = [
+            Query.search(Embeddings(), cur, query, 10, 0.0) for query in queries
+        ]
+
+        # Queries still searching share a round, finished queries drop out
+        embeddings = Embeddings()
+        self.assertEqual(Query.batchsearch(embeddings, cur, queries, 10, 0.0), expected)
+        self.assertEqual(embeddings.calls, [(3, 50), (2, 100)])
+
+        db.close()
+
+    def testFulltext(self):
+        """
+        Test full text token lookups match substring filtering
+        """
+
+        dbfile = database()
+
+        db = sqlite3.connect(dbfile)
+        cur = db.cursor()
+
+        # No full text index, all sections allowed
+        self.assertEqual(Query.fulltext(cur, ["risk"], []), (None, set()))
+
+        Index.prepare(dbfile, True)
+        self.assertTrue(Index.fulltext(cur))
+
+        cur.execute("SELECT Id, Text FROM sections")
+        sections = cur.fetchall()
+
+        def scan(token):
+            return {uid for uid, text in sections if text and token in text.lower()}
+
+        allowed, forbidden = Query.fulltext(cur, ["Risk", "factor", "ci"], ["vaccine"])
+        self.assertEqual(allowed, scan("risk") & scan("factor"))
+        self.assertEqual(forbidden, scan("vaccine"))
+
+        # Common tokens are left to search hit filtering
+        with patch.object(Query, "RESCORE", 50):
+            self.assertEqual(Query.fulltext(cur, ["risk"], ["vaccine"]), (None, set()))
+
+        # Sections appended after the full text index is built are added on the next run
+        cur.execute(
+            "INSERT INTO sections (Id, Article, Text, Tags) VALUES (?, ?, ?, ?)",
+            [300, "100", "Treatment risk factors", "tags"],
+        )
+        db.commit()
+
+        Index.prepare(dbfile)
+        allowed, _ = Query.fulltext(cur, ["risk", "factor"], [])
+        self.assertEqual(allowed, scan("risk") & scan("factor") | {300})
+
+        # Rare required tokens are scored directly, sections excluded from the
+        # embeddings index are skipped. Results are limited to the candidate pool
+        # size of an embeddings search.
+        cur.execute("UPDATE sections SET Tags = NULL WHERE Id < 30")
+
+        embeddings = Embeddings()
+        results = Query.search(embeddings, cur, "risk +factor", 10, 0.0)
+        self.assertFalse(embeddings.calls)
+        self.assertEqual(
+            [uid for uid, _, _, _ in results],
+            sorted(uid for uid in allowed if uid >= 30)[:50],
+        )
+
+        db.close()
+
+    def testStream(self):
+        """
+        Test streamed article ids match report date ordering
+        """
+
+        db = sqlite3.connect(":memory:")
+        db.execute("CREATE TABLE articles (Id TEXT PRIMARY KEY, Published DATETIME)")
+
+        dates = [
+            "2020-01-01 00:00:00",
+            "2020-05-01 00:00:00",
+            None,
+            "2019-12-31 00:00:00",
+            "2020-05-01 00:00:00",
+            "2021-01-01 00:00:00",
+            "2020-01-02 00:00:00",
+        ]
+        for x, date in enumerate(dates):
+            db.execute("INSERT INTO articles VALUES (?, ?)", ["%d" % (9 - x), date])
+
+        cur = db.cursor()
+
+        # Report ordering, sorted by formatted date desc, ties in id order
+        expected = sorted(
+            Query.all(cur),
+            key=lambda uid: Query.date(dates[9 - int(uid)]) or "",
+            reverse=True,
+        )
+
+        batches = list(Query.stream(cur, 3))
+        self.assertEqual([len(batch) for batch in batches], [3, 3, 1])
+        self.assertEqual([uid for batch in batches for uid in batch], expected)
+
+        db.close()
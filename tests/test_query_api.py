@@ -0,0 +1,109 @@
+"""
+Query API module tests
+"""
+
+import json
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+# pylint: disable=E0401
+from paperai import cli, query_api
+from paperai.index import Index
+from paperai.models import Models
+from tests.utils import Utils
+
+
+class TestQueryAPI(unittest.TestCase):
+    """
+    Query API tests
+    """
+
+    @staticmethod
+    def ready(client, timeout=60):
+        """
+        Wait for the model to be ready.
+
+        Args:
+            client: test client
+            timeout: maximum number of seconds to wait
+
+        Returns:
+            True if the model is ready
+        """
+        start = time.time()
+        while time.time() - start < timeout:
+            if client.get("ready").status_code == 200:
+                return True
+
+            time.sleep(0.1)
+
+        return False
+
+    def testQuery(self):
+        """
+        Test model is loaded in the background at startup and queries are served
+        """
+
+        # Build embeddings index
+        Index.run(Utils.PATH, Utils.VECTORFILE)
+
+        # Model isn't loaded before startup
+        client = TestClient(query_api.app)
+        self.assertEqual(client.get("ready").status_code, 503)
+        self.assertEqual(client.get("query/risk factors").status_code, 503)
+
+        # Hold model loading until released
+        released, load_model = threading.Event(), cli.load_model
+
+        def load(**kwargs):
+            released.wait()
+            return load_model(**kwargs)
+
+        with patch.object(Models, "modelPath", return_value=Utils.PATH), patch.object(
+            cli, "load_model", side_effect=load
+        ):
+            with TestClient(query_api.app) as client:
+                # Requests are served while the model loads
+                self.assertEqual(client.get("ready").json(), {"Ready": False})
+                self.assertEqual(client.get("query/risk factors").status_code, 503)
+
+                released.set()
+                self.assertTrue(TestQueryAPI.ready(client))
+
+                results = [client.get("query/risk factors").json() for _ in range(3)]
+                self.assertTrue(results[0])
+                self.assertEqual(results[0], results[1])
+                self.assertEqual(results[0], results[2])
+
+                # Batch queries stream one result line per query
+                response = client.post(
+                    "query-batch", json={"queries": ["risk factors"] * 3}
+                )
+                lines = [json.loads(line) for line in response.text.splitlines()]
+                self.assertEqual(
+                    [line["query"] for line in lines], ["risk factors"] * 3
+                )
+                self.assertTrue(all(line["results"] for line in lines))
+
+                # Batch slot is released when the stream closes early or never starts
+                batch = query_api.BatchQuery(queries=["risk factors"] * 3)
+                for consumed in [0, 1]:
+                    response = client.portal.call(query_api.query_batch, batch)
+                    self.assertEqual(query_api.LOADED_MODEL.pending, 1)
+
+                    if consumed:
+                        client.portal.call(response.body_iterator.__anext__)
+
+                    client.portal.call(response.body_iterator.aclose)
+                    client.portal.call(response.background)
+                    self.assertEqual(query_api.LOADED_MODEL.pending, 0)
+
+                # All queries released their slot
+                self.assertEqual(query_api.LOADED_MODEL.pending, 0)
+
+        # Model is released at shutdown
+        self.assertFalse(query_api.LOADED_MODEL.ready)
@@ -0,0 +1,94 @@
+"""
+Registry module tests
+"""
+
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+# pylint: disable=E0401
+from paperai.models import Models
+from paperai.registry import Registry
+
+
+class TestRegistry(unittest.TestCase):
+    """
+    Registry tests
+    """
+
+    def setUp(self):
+        """
+        Create a model path with an index config file and database.
+        """
+
+        self.path = tempfile.mkdtemp()
+        self.config = os.path.join(self.path, "config")
+
+        with open(self.config, "w") as output:
+            output.write("config")
+
+        sqlite3.connect(os.path.join(self.path, "articles.sqlite")).close()
+
+    def testShared(self):
+        """
+        Test indexes are loaded once and shared
+        """
+
+        registry = Registry()
+
+        with patch.object(
+            Models, "embeddings", side_effect=lambda path, mmap: object()
+        ) as embeddings:
+            e1, db1 = registry.load(self.path)
+            e2, db2 = registry.load(self.path)
+
+            self.assertIs(e1, e2)
+            self.assertEqual(embeddings.call_count, 1)
+            self.assertEqual(registry.references(self.path), 2)
+
+            registry.close(e1, db1)
+            registry.close(e2, db2)
+            self.assertEqual(registry.references(self.path), 0)
+
+            # Index stays loaded without references
+            e3, db3 = registry.load(self.path)
+            self.assertIs(e1, e3)
+            self.assertEqual(embeddings.call_count, 1)
+            registry.close(e3, db3)
+
+        with self.assertRaises(FileExistsError):
+            registry.load(os.path.join(self.path, "missing"))
+
+    def testSwap(self):
+        """
+        Test rebuilt indexes are reloaded
+        """
+
+        registry = Registry()
+
+        with patch.object(
+            Models, "embeddings", side_effect=lambda path, mmap: object()
+        ):
+            e1, db1 = registry.load(self.path)
+
+            # Simulate an index rebuild
+            mtime = time.time() + 10
+            os.utime(self.config, (mtime, mtime))
+
+            e2, db2 = registry.load(self.path)
+            self.assertIsNot(e1, e2)
+
+            # Each index keeps the version it was loaded with
+            self.assertLess(registry.version(e1), registry.version(e2))
+            self.assertIsNone(registry.version(object()))
+
+            # Previous index is kept until released
+            self.assertEqual(len(registry.entries), 2)
+            registry.close(e1, db1)
+            self.assertEqual(len(registry.entries), 1)
+
+            self.assertEqual(registry.references(self.path), 1)
+            registry.close(e2, db2)
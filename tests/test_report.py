@@ -3,7 +3,12 @@ Report module tests
 """
 
 import os
+import tempfile
 import unittest
+from unittest.mock import patch
+
+import yaml
+from txtai.pipeline import Extractor
 
 # pylint: disable=E0401
 from paperai.report.execute import Execute
@@ -77,3 +82,86 @@ class TestReport(unittest.TestCase):
         # Check file hashes
         for name, value in hashes:
             self.assertEqual(Utils.hashfile(Utils.PATH + "/" + name), value)
+
+    @unittest.skipIf(os.name == "nt", "Faiss not installed on Windows")
+    def testBatch(self):
+        """
+        Runs test queries from report2.yml test file with small QA batches
+        """
+
+        self.compare({"batchsize": 3})
+
+    @unittest.skipIf(os.name == "nt", "Faiss not installed on Windows")
+    def testCache(self):
+        """
+        Runs test queries from report2.yml test file with an extraction cache
+        """
+
+        cache = os.path.join(tempfile.mkdtemp(), "extraction.sqlite")
+
+        # First run stores answers
+        self.compare({"cache": cache})
+
+        # Second run reads all answers from the cache, the QA model isn't run
+        path = TestReport.config({"cache": cache})
+        with patch.object(Extractor, "answers") as answers:
+            Execute.run(path + "/report2.yml", 10, "csv", Utils.PATH, None)
+            self.assertFalse(answers.called)
+
+        self.same(path)
+
+    @unittest.skipIf(os.name == "nt", "Faiss not installed on Windows")
+    def compare(self, options):
+        """
+        Runs test queries from report2.yml test file with additional options and
+        checks output is the same as the default options.
+
+        Args:
+            options: report options
+        """
+
+        path = TestReport.config(options)
+
+        # Execute default and modified reports
+        Execute.run(Utils.PATH + "/report2.yml", 10, "csv", Utils.PATH, None)
+        Execute.run(path + "/report2.yml", 10, "csv", Utils.PATH, None)
+
+        self.same(path)
+
+    @staticmethod
+    def config(options):
+        """
+        Copies report2.yml test file to a temporary directory with additional
+        options.
+
+        Args:
+            options: report options
+
+        Returns:
+            temporary directory
+        """
+
+        with open(Utils.PATH + "/report2.yml", "r") as f:
+            config = yaml.safe_load(f)
+
+        config.setdefault("options", {}).update(options)
+
+        path = tempfile.mkdtemp()
+        with open(path + "/report2.yml", "w") as f:
+            yaml.dump(config, f)
+
+        return path
+
+    def same(self, path):
+        """
+        Checks report output in path is the same as the default report output.
+
+        Args:
+            path: report output directory
+        """
+
+        for name in ["Match.csv", "MatchSurround.csv", "Section.csv", "Surround.csv"]:
+            self.assertEqual(
+                Utils.hashfile(path + "/" + name),
+                Utils.hashfile(Utils.PATH + "/" + name),
+            )
@@ -0,0 +1,78 @@
+"""
+Shards module tests
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+# pylint: disable=E0401
+from paperai.index import Index
+from paperai.models import Models
+from paperai.shards import Shards
+from tests.utils import Utils
+
+
+class TestShards(unittest.TestCase):
+    """
+    Shards tests
+    """
+
+    def testSearch(self):
+        """
+        Test sharded index build and scatter-gather search
+        """
+
+        path = tempfile.mkdtemp()
+        shutil.copy(Utils.DBFILE, path)
+
+        for partition in ["hash", "date"]:
+            Index.run(path, Utils.VECTORFILE, shards=3, partition=partition)
+            self.assertFalse(os.path.exists(os.path.join(path, "config")))
+
+            embeddings, db = Models.load(path)
+            self.assertIsInstance(embeddings, Shards)
+
+            # All documents are assigned to exactly one shard
+            self.assertEqual(
+                embeddings.count(), len(list(Index.stream(Utils.DBFILE, 0)))
+            )
+
+            # Merged results are the top results across all shards
+            results = embeddings.search("risk factors", 10)
+            self.assertEqual(len(results), 10)
+            self.assertEqual(results, sorted(results, key=lambda x: x[1], reverse=True))
+            self.assertEqual(
+                results[0],
+                max(
+                    (shard.search("risk factors", 1)[0] for shard in embeddings.shards),
+                    key=lambda x: x[1],
+                ),
+            )
+
+            # Queries are transformed once with the first shard
+            with patch.object(embeddings.shards[1], "transform") as transform:
+                self.assertEqual(embeddings.search("risk factors", 10), results)
+                self.assertFalse(transform.called)
+
+            # Loaded shards share one copy of the vectors, scoring and LSA models
+            for shard in embeddings.shards[1:]:
+                self.assertIs(shard.model, embeddings.shards[0].model)
+                self.assertIs(shard.scoring, embeddings.shards[0].scoring)
+                self.assertIs(shard.reducer, embeddings.shards[0].reducer)
+
+            # Shards share the same scoring and LSA models
+            for name in ["lsa", "scoring"]:
+                files = set()
+                for shard in Shards.paths(os.path.join(path, "shards")):
+                    with open(os.path.join(shard, name), "rb") as f:
+                        files.add(f.read())
+
+                self.assertEqual(len(files), 1)
+
+            embeddings.close()
+            self.assertIsNone(embeddings.pool)
+
+            Models.close(db)